@@ -1,51 +1,159 @@
+import os
+import time
 import streamlit as st
-import json
-import boto3
+from botocore.exceptions import ClientError
 from utils.auth import Auth
+from utils.cache import ResponseCache
+from utils.jobs import JobClient
 from utils.llm import Llm
+from utils.metrics import Metrics
 
-# ID of Secrets Manager containing cognito parameters
-secrets_manager_id = "StreamlitApplicationsParamCognitoSecret"
+# Start of the script rerun, to measure its duration, and time spent waiting
+# for the jobs of the worker service, which is not part of it
+rerun_start = time.perf_counter()
+job_wait_seconds = 0.
 
-# Initialise CognitoAuthenticator
-authenticator = Auth.get_authenticator(secrets_manager_id)
+# The duration is emitted on every exit of the script, including st.stop()
+# and the reruns interrupting it, which raise exceptions
+try:
+    # ID of Secrets Manager containing cognito parameters
+    secrets_manager_id = "StreamlitApplicationsParamCognitoSecret"
 
-# Authenticate user, and stop here if not logged in
-is_logged_in = authenticator.login()
-if not is_logged_in:
-    st.stop()
+    # Initialise CognitoAuthenticator
+    authenticator = Auth.get_authenticator(secrets_manager_id)
 
+    # Authenticate user, and stop here if not logged in
+    is_logged_in = authenticator.login()
+    if not is_logged_in:
+        st.stop()
 
-def logout():
-    authenticator.logout()
 
+    def logout():
+        authenticator.logout()
 
 
-with st.sidebar:
-    st.text(f"Welcome {authenticator.get_username()}")
-    st.button("Logout", "logout_btn", on_click=logout)
-    
 
-# Add title on the page
-st.title("Generative AI Application")
+    with st.sidebar:
+        st.text(f"Welcome {authenticator.get_username()}")
+        st.button("Logout", "logout_btn", on_click=logout)
+        use_cache = st.checkbox("Use cached responses", value=True)
 
-# Ask user for input text
-input_sent = st.text_input("Input Sentence", "Say Hello World! in Spanish, French and Japanese.")
 
-# Create the large language model object
-llm = Llm()
+    # Add title on the page
+    st.title("Generative AI Application")
 
-# When there is an input text to process
-if input_sent:
-    # Invoke the Bedrock foundation model
-    response = llm.invoke(input_sent)
+    # Ask user for input text
+    input_sent = st.text_input("Input Sentence", "Say Hello World! in Spanish, French and Japanese.")
 
-    # Transform response to json
-    json_response = json.loads(response.get("body").read())
 
-    # Format response and print it in the console
-    pretty_json_output = json.dumps(json_response, indent=2)
-    print("API response: ", pretty_json_output)
+    @st.cache_resource
+    def get_response_cache():
+        """
+        Response cache shared by all the sessions of the container, backed by
+        the prefix of the application in the applications bucket
+        """
+        return ResponseCache(
+            bucket_name=os.environ.get("APPLICATION_BUCKET_NAME"),
+            prefix=f"{os.environ.get('APPLICATION_NAME', 'local')}/",
+        )
 
-    # Write response on Streamlit web interface
-    st.write("**Foundation model output** \n\n", json_response['completion'])
+
+    # Create the large language model object, it uses the Bedrock client
+    # shared by all the sessions of the container
+    llm = Llm(cache=get_response_cache())
+
+    # When there is an input text to process
+    if input_sent:
+        st.write("**Foundation model output** \n\n")
+
+        # The completion of the last input is kept in the session, so that the
+        # reruns of the other widgets do not invoke the model again
+        last_completion = st.session_state.get("last_completion")
+        if last_completion is not None and last_completion["input"] == (input_sent, use_cache):
+            st.markdown(last_completion["completion"])
+        else:
+            # Invoke the Bedrock foundation model and render the completion
+            # incrementally, as the chunks are generated
+            placeholder = st.empty()
+            completion = ""
+            for chunk in llm.stream(input_sent, use_cache=use_cache):
+                completion += chunk
+                placeholder.markdown(completion)
+            st.session_state["last_completion"] = {"input": (input_sent, use_cache), "completion": completion}
+
+            # Print the time to first token and the full completion in the console
+            print("Time to first token (s): ", llm.last_time_to_first_token)
+            print("API response: ", completion)
+
+
+    @st.cache_resource
+    def get_job_client():
+        """
+        Client of the queue of the jobs of the application, in job mode only
+        """
+        if not os.environ.get("JOB_QUEUE_URL"):
+            return None
+        return JobClient()
+
+
+    job_client = get_job_client()
+
+    # Time after which a summary job is considered lost, e.g. moved to the dead
+    # letter queue after its workers stopped before the end
+    SUMMARY_JOB_TIMEOUT_SECONDS = int(os.environ.get("SUMMARY_JOB_TIMEOUT_SECONDS", 3600))
+
+    # Summarise texts longer than the model context, e.g. a video transcript
+    text_to_summarise = st.text_area("Text to summarise")
+    if text_to_summarise and st.button("Summarise"):
+        if job_client is not None:
+            # In job mode, the summary runs on the worker service, and is
+            # polled below
+            try:
+                job_id = job_client.submit("summarize", {"text": text_to_summarise, "use_cache": use_cache})
+            except ClientError as e:
+                st.error(f"The summary could not be submitted: {e}")
+            else:
+                st.session_state["summary_job"] = {"job_id": job_id, "submitted_at": time.time()}
+        else:
+            progress_bar = st.progress(0., text="Summarising")
+
+            def show_progress(stage, done, total):
+                progress_bar.progress(done / total, text=f"Summarising ({stage}): {done}/{total}")
+
+            summary = llm.summarize(text_to_summarise, use_cache=use_cache, progress=show_progress)
+            progress_bar.empty()
+            st.write("**Summary** \n\n")
+            st.markdown(summary)
+
+    def cancel_summary_job():
+        st.session_state.pop("summary_job", None)
+
+
+    # Poll the summary job in place, without rerunning the script. A rerun
+    # triggered by the user interrupts the polling, which resumes at the end of
+    # the rerun as the job is kept in the session, until its deadline
+    if job_client is not None and "summary_job" in st.session_state:
+        summary_job = st.session_state["summary_job"]
+        deadline = summary_job["submitted_at"] + SUMMARY_JOB_TIMEOUT_SECONDS
+        st.button("Cancel the summary", on_click=cancel_summary_job)
+        job_status = st.empty()
+        job = job_client.get(summary_job["job_id"])
+        while job["status"] not in ("COMPLETED", "FAILED") and time.time() < deadline:
+            job_status.info(f"Summary job {job['status'].lower()}...")
+            wait_start = time.perf_counter()
+            time.sleep(2)
+            job = job_client.get(summary_job["job_id"])
+            job_wait_seconds += time.perf_counter() - wait_start
+        job_status.empty()
+        del st.session_state["summary_job"]
+        if job["status"] == "COMPLETED":
+            st.write("**Summary** \n\n")
+            st.markdown(job["result"]["summary"])
+        elif job["status"] == "FAILED":
+            st.error(f"The summary failed: {job['error']}")
+        else:
+            st.error(f"The summary did not complete within {SUMMARY_JOB_TIMEOUT_SECONDS // 60} minutes")
+finally:
+    # Emit the duration of the script rerun, without the wait for the jobs
+    rerun_seconds = time.perf_counter() - rerun_start - job_wait_seconds
+    Metrics().emit({"RerunDuration": (rerun_seconds * 1000, "Milliseconds")})
@@ -1,31 +1,122 @@
 import boto3
 import json
+import threading
+import time
 from streamlit_cognito_auth import CognitoAuthenticator
 
 
+class SecretCache:
+    """
+    Thread-safe in-process cache of Secrets Manager secrets, shared by all
+    the Streamlit sessions of the container.
+
+    A secret is fetched at most once per TTL. Once a cached secret is older
+    than refresh_ratio * ttl, it is refreshed in a background thread while
+    the cached value keeps being served, so reruns do not wait on
+    Secrets Manager and new secret versions are still picked up.
+    """
+
+    def __init__(self, client=None, ttl=300, refresh_ratio=0.8, clock=time.monotonic):
+        self._client = client
+        self.ttl = ttl
+        self.refresh_ratio = refresh_ratio
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._secrets = {}
+        self._fetch_locks = {}
+        self._refresh_threads = {}
+
+    def _get_client(self):
+        with self._lock:
+            if self._client is None:
+                self._client = boto3.client("secretsmanager")
+            return self._client
+
+    def _fetch(self, secret_id):
+        response = self._get_client().get_secret_value(SecretId=secret_id)
+        secret = {
+            "SecretString": response["SecretString"],
+            "VersionId": response.get("VersionId"),
+        }
+        with self._lock:
+            self._secrets[secret_id] = (self._clock(), secret)
+        return secret
+
+    def _refresh(self, secret_id):
+        try:
+            self._fetch(secret_id)
+        except Exception as e:
+            # Keep serving the cached value, the secret will be fetched
+            # synchronously once the TTL has expired
+            print(f"Failed to refresh secret {secret_id}: {e}")
+        finally:
+            with self._lock:
+                self._refresh_threads.pop(secret_id, None)
+
+    def get_secret(self, secret_id):
+        """
+        Returns a dict with the SecretString and the VersionId of the secret
+        """
+        with self._lock:
+            cached = self._secrets.get(secret_id)
+            fetch_lock = self._fetch_locks.setdefault(secret_id, threading.Lock())
+
+        if cached is None or self._clock() - cached[0] >= self.ttl:
+            with fetch_lock:
+                # Another session may have fetched the secret while we waited
+                with self._lock:
+                    cached = self._secrets.get(secret_id)
+                if cached is None or self._clock() - cached[0] >= self.ttl:
+                    return self._fetch(secret_id)
+            return cached[1]
+
+        fetched_at, secret = cached
+        if self._clock() - fetched_at >= self.ttl * self.refresh_ratio:
+            with self._lock:
+                if secret_id not in self._refresh_threads:
+                    thread = threading.Thread(target=self._refresh, args=(secret_id,), daemon=True)
+                    self._refresh_threads[secret_id] = thread
+                    thread.start()
+
+        return secret
+
+
 class Auth:
 
+    # Secrets and Cognito clients are shared by all the sessions of the container
+    secret_cache = SecretCache()
+    _cognito_clients = {}
+    _cognito_clients_lock = threading.Lock()
+
+    @staticmethod
+    def _get_cognito_client(pool_id):
+        region = pool_id.split("_")[0]
+        with Auth._cognito_clients_lock:
+            if region not in Auth._cognito_clients:
+                Auth._cognito_clients[region] = boto3.client("cognito-idp", region_name=region)
+            return Auth._cognito_clients[region]
+
     @staticmethod
     def get_authenticator(secret_id):
         """
         Get Cognito parameters from Secrets Manager and
         returns a CognitoAuthenticator object.
         """
-        # Get Cognito parameters from Secrets Manager
-        secretsmanager_client = boto3.client("secretsmanager")
-        response = secretsmanager_client.get_secret_value(
-            SecretId=secret_id,
-        )
-        secret_string = json.loads(response['SecretString'])
+        # Get Cognito parameters from the cached Secrets Manager secret
+        secret = Auth.secret_cache.get_secret(secret_id)
+        secret_string = json.loads(secret['SecretString'])
         pool_id = secret_string['pool_id']
         app_client_id = secret_string['app_client_id']
         app_client_secret = secret_string['app_client_secret']
 
-        # Initialise CognitoAuthenticator
+        # Initialise CognitoAuthenticator. It holds the cookies of the current
+        # session so it is created on every rerun, but it reuses the shared
+        # Cognito client
         authenticator = CognitoAuthenticator(
             pool_id=pool_id,
             app_client_id=app_client_id,
             app_client_secret=app_client_secret,
+            boto_client=Auth._get_cognito_client(pool_id),
         )
 
         return authenticator
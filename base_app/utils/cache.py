@@ -0,0 +1,141 @@
+import boto3
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from botocore.exceptions import BotoCoreError, ClientError
+
+
+class ResponseCache:
+    """
+    Content-addressed cache of foundation model responses.
+
+    Responses are keyed on a hash of the model id and of the request body
+    (prompt and inference parameters). They are kept in a bounded in-memory
+    LRU tier shared by the sessions of the container and, when a bucket is
+    given, in a second tier under the prefix of the application in the
+    applications bucket, shared by all the tasks of the application.
+    """
+
+    def __init__(self, max_entries=256, ttl=3600, bucket_name=None, prefix="",
+                 s3_ttl=86400, s3_client=None, clock=time.time):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.bucket_name = bucket_name
+        self.prefix = prefix
+        self.s3_ttl = s3_ttl
+        self._s3_client = s3_client
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+        self.memory_hits = 0
+        self.s3_hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(model_id, body):
+        """
+        Returns the cache key of a request to a foundation model
+        """
+        if isinstance(body, str):
+            body = json.loads(body)
+        payload = json.dumps({"modelId": model_id, "body": body}, sort_keys=True)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _get_s3_client(self):
+        with self._lock:
+            if self._s3_client is None:
+                self._s3_client = boto3.client("s3")
+            return self._s3_client
+
+    def _s3_key(self, key):
+        return f"{self.prefix}llm-cache/{key}.json"
+
+    def _get_from_memory(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            created_at, value = entry
+            if self._clock() - created_at >= self.ttl:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def _put_in_memory(self, key, value, created_at):
+        with self._lock:
+            self._entries[key] = (created_at, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _get_from_s3(self, key):
+        try:
+            response = self._get_s3_client().get_object(Bucket=self.bucket_name, Key=self._s3_key(key))
+            entry = json.loads(response["Body"].read())
+        except ClientError as e:
+            if e.response["Error"]["Code"] not in ("NoSuchKey", "404"):
+                print(f"Failed to read cached response {key}: {e}")
+            return None
+        except BotoCoreError as e:
+            print(f"Failed to read cached response {key}: {e}")
+            return None
+
+        if self._clock() - entry["created_at"] >= self.s3_ttl:
+            return None
+        return entry
+
+    def get(self, key):
+        """
+        Returns the cached response for the key, or None
+        """
+        value = self._get_from_memory(key)
+        if value is not None:
+            with self._lock:
+                self.memory_hits += 1
+            return value
+
+        if self.bucket_name:
+            entry = self._get_from_s3(key)
+            if entry is not None:
+                self._put_in_memory(key, entry["value"], entry["created_at"])
+                with self._lock:
+                    self.s3_hits += 1
+                return entry["value"]
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, key, value):
+        """
+        Stores a response in the cache
+        """
+        created_at = self._clock()
+        self._put_in_memory(key, value, created_at)
+
+        if self.bucket_name:
+            try:
+                self._get_s3_client().put_object(
+                    Bucket=self.bucket_name,
+                    Key=self._s3_key(key),
+                    Body=json.dumps({"created_at": created_at, "value": value}).encode("utf-8"),
+                    ContentType="application/json",
+                )
+            except (BotoCoreError, ClientError) as e:
+                print(f"Failed to write cached response {key}: {e}")
+
+    def stats(self):
+        """
+        Returns the hit and miss counters of the cache
+        """
+        with self._lock:
+            return {
+                "memory_hits": self.memory_hits,
+                "s3_hits": self.s3_hits,
+                "misses": self.misses,
+                "entries": len(self._entries),
+            }
@@ -0,0 +1,89 @@
+import hashlib
+import math
+import re
+
+# Approximate number of characters per token of English text for the
+# Anthropic models, used to budget the prompts without a tokenizer
+CHARS_PER_TOKEN = 4
+
+# On average, a chunk ends after one in BOUNDARY_MODULUS sentences once it
+# has reached its minimum size
+BOUNDARY_MODULUS = 4
+
+
+def estimate_tokens(text):
+    """
+    Returns an estimate of the number of tokens of a text
+    """
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+def split_sentences(text, max_tokens):
+    """
+    Split a text in sentences, themselves split in pieces of at most
+    max_tokens tokens when they are longer
+    """
+    sentences = []
+    for sentence in re.split(r"(?<=[.!?])\s+|\n+", text):
+        sentence = " ".join(sentence.split())
+        if not sentence:
+            continue
+        words = sentence.split(" ")
+        piece = []
+        for word in words:
+            if piece and estimate_tokens(" ".join(piece + [word])) > max_tokens:
+                sentences.append(" ".join(piece))
+                piece = []
+            piece.append(word)
+        sentences.append(" ".join(piece))
+    return sentences
+
+
+def _is_boundary(sentence):
+    # Stable across processes, unlike the builtin hash() of strings
+    return int(hashlib.sha256(sentence.encode("utf-8")).hexdigest(), 16) % BOUNDARY_MODULUS == 0
+
+
+def split_text(text, max_tokens=2000, overlap_tokens=200):
+    """
+    Split a text in chunks of at most max_tokens tokens, each one starting
+    with the last sentences, up to overlap_tokens tokens, of the previous one.
+
+    The chunks end after the sentences selected by their content, once they
+    have reached half of max_tokens, instead of at fixed offsets: an edit of
+    the text only changes the chunks around it, and the chunks after it are
+    the same as before the edit.
+    """
+    if overlap_tokens >= max_tokens // 2:
+        raise ValueError(f"overlap_tokens {overlap_tokens} must be less than half of max_tokens {max_tokens}")
+
+    # The overlap is taken out of the budget of the chunks
+    budget = max_tokens - overlap_tokens
+    groups = []
+    group = []
+    group_tokens = 0
+    for sentence in split_sentences(text, budget - 1):
+        sentence_tokens = estimate_tokens(sentence) + 1
+        if group and group_tokens + sentence_tokens > budget:
+            groups.append(group)
+            group, group_tokens = [], 0
+        group.append(sentence)
+        group_tokens += sentence_tokens
+        if group_tokens >= budget // 2 and _is_boundary(sentence):
+            groups.append(group)
+            group, group_tokens = [], 0
+    if group:
+        groups.append(group)
+
+    chunks = []
+    for i, group in enumerate(groups):
+        overlap = []
+        if i > 0:
+            overlap_size = 0
+            for sentence in reversed(groups[i - 1]):
+                overlap_size += estimate_tokens(sentence) + 1
+                if overlap_size > overlap_tokens:
+                    break
+                overlap.insert(0, sentence)
+        chunks.append(" ".join(overlap + group))
+    return chunks
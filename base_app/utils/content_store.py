@@ -0,0 +1,174 @@
+import boto3
+import hashlib
+import mmap
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from botocore.exceptions import ClientError
+
+MB = 1024 * 1024
+
+
+class ContentStore:
+    """
+    Read-through cache, on the local disk of the container, of the objects
+    under the prefix of the application in the applications bucket.
+
+    Cached objects are validated by ETag with a conditional GET, so an
+    unchanged object costs a 304 response instead of a full download.
+    Large objects are downloaded with ranged GETs sent in parallel, and are
+    returned memory-mapped instead of being read in memory. The cache is
+    bounded in size, the least recently used objects are evicted first.
+    """
+
+    def __init__(self, bucket_name=None, prefix=None, cache_dir=None, max_bytes=1024 * MB, s3_client=None,
+                 part_size=8 * MB, max_concurrency=8, mmap_threshold=64 * MB):
+        self.bucket_name = bucket_name or os.environ["APPLICATION_BUCKET_NAME"]
+        self.prefix = prefix if prefix is not None else f"{os.environ.get('APPLICATION_NAME', 'local')}/"
+        self.cache_dir = cache_dir or tempfile.mkdtemp(prefix="content-store-")
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.s3_client = s3_client or boto3.client("s3")
+        self.part_size = part_size
+        self.max_concurrency = max_concurrency
+        self.mmap_threshold = mmap_threshold
+
+        self._lock = threading.Lock()
+        self._key_locks = {}
+        # key -> (etag, size) of the cached objects, in least recently used order
+        self._entries = OrderedDict()
+        self._size = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.bytes_saved = 0
+        self.bytes_downloaded = 0
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, hashlib.sha256(key.encode("utf-8")).hexdigest())
+
+    def _download(self, key, size, etag, response=None):
+        """
+        Download an object to a temporary file, with parallel ranged GETs for
+        large objects, and returns the path of the file. response is the
+        response of a GET of the object already sent, if any
+        """
+        full_key = self.prefix + key
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".part")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                if size < 2 * self.part_size:
+                    if response is None:
+                        response = self.s3_client.get_object(Bucket=self.bucket_name, Key=full_key, IfMatch=etag)
+                    for chunk in response["Body"].iter_chunks(MB):
+                        f.write(chunk)
+                else:
+                    if response is not None:
+                        response["Body"].close()
+                    f.truncate(size)
+
+            if size >= 2 * self.part_size:
+                def download_part(start):
+                    end = min(start + self.part_size, size) - 1
+                    part = self.s3_client.get_object(Bucket=self.bucket_name, Key=full_key,
+                                                     Range=f"bytes={start}-{end}", IfMatch=etag)
+                    with open(tmp_path, "r+b") as part_file:
+                        part_file.seek(start)
+                        for chunk in part["Body"].iter_chunks(MB):
+                            part_file.write(chunk)
+
+                with ThreadPoolExecutor(max_workers=self.max_concurrency) as executor:
+                    list(executor.map(download_part, range(0, size, self.part_size)))
+        except Exception:
+            os.remove(tmp_path)
+            raise
+        return tmp_path
+
+    def _store(self, key, tmp_path, etag, size):
+        with self._lock:
+            os.replace(tmp_path, self._path(key))
+            if key in self._entries:
+                self._size -= self._entries.pop(key)[1]
+            self._entries[key] = (etag, size)
+            self._size += size
+            self.misses += 1
+            self.bytes_downloaded += size
+
+            # Evict the least recently used objects, except the one just stored
+            # and the ones being validated or downloaded by another thread
+            for evicted_key in list(self._entries):
+                if self._size <= self.max_bytes:
+                    break
+                evicted_key_lock = self._key_locks.get(evicted_key)
+                if evicted_key == key or (evicted_key_lock is not None and evicted_key_lock.locked()):
+                    continue
+                _, evicted_size = self._entries.pop(evicted_key)
+                self._size -= evicted_size
+                os.remove(self._path(evicted_key))
+
+    def get_path(self, key):
+        """
+        Returns the path of the local copy of an object, key being relative
+        to the prefix of the application
+        """
+        full_key = self.prefix + key
+        with self._lock:
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+
+        with key_lock:
+            with self._lock:
+                entry = self._entries.get(key)
+
+            response = None
+            if entry is not None:
+                try:
+                    response = self.s3_client.get_object(Bucket=self.bucket_name, Key=full_key, IfNoneMatch=entry[0])
+                except ClientError as e:
+                    if e.response["Error"]["Code"] not in ("304", "NotModified"):
+                        raise
+                    with self._lock:
+                        # An object evicted in the meantime is downloaded again
+                        if self._entries.get(key) == entry:
+                            self._entries.move_to_end(key)
+                            self.hits += 1
+                            self.bytes_saved += entry[1]
+                            return self._path(key)
+
+            if response is not None:
+                etag, size = response["ETag"], response["ContentLength"]
+            else:
+                head = self.s3_client.head_object(Bucket=self.bucket_name, Key=full_key)
+                etag, size = head["ETag"], head["ContentLength"]
+
+            tmp_path = self._download(key, size, etag, response)
+            self._store(key, tmp_path, etag, size)
+            return self._path(key)
+
+    def read(self, key):
+        """
+        Returns the content of an object: bytes, or a read-only memory map
+        for objects larger than the mmap threshold
+        """
+        path = self.get_path(key)
+        with open(path, "rb") as f:
+            if os.fstat(f.fileno()).st_size >= self.mmap_threshold:
+                return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            return f.read()
+
+    def stats(self):
+        """
+        Returns the hit rate and the bytes saved by the cache
+        """
+        with self._lock:
+            requests = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / requests if requests else 0.,
+                "bytes_saved": self.bytes_saved,
+                "bytes_downloaded": self.bytes_downloaded,
+                "cached_bytes": self._size,
+                "entries": len(self._entries),
+            }
@@ -0,0 +1,203 @@
+import boto3
+import json
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from botocore.exceptions import ClientError
+
+
+class JobStore:
+    """
+    Status and results of the jobs of the application, stored as JSON objects
+    under the prefix of the application in the applications bucket
+    """
+
+    def __init__(self, bucket_name=None, prefix=None, s3_client=None):
+        self.bucket_name = bucket_name or os.environ["APPLICATION_BUCKET_NAME"]
+        self.prefix = prefix if prefix is not None else f"{os.environ.get('APPLICATION_NAME', 'local')}/"
+        self.s3_client = s3_client or boto3.client("s3")
+
+    def _key(self, job_id):
+        return f"{self.prefix}jobs/{job_id}.json"
+
+    def put_input(self, job_id, payload):
+        """
+        Store the payload of a job, which can be larger than an SQS message,
+        and returns its key
+        """
+        key = f"{self.prefix}jobs/{job_id}/input.json"
+        self.s3_client.put_object(Bucket=self.bucket_name, Key=key, Body=json.dumps(payload),
+                                  ContentType="application/json")
+        return key
+
+    def get_input(self, key):
+        """
+        Returns the payload of a job stored by put_input
+        """
+        response = self.s3_client.get_object(Bucket=self.bucket_name, Key=key)
+        return json.loads(response["Body"].read())
+
+    def put(self, job_id, status, result=None, error=None):
+        self.s3_client.put_object(Bucket=self.bucket_name, Key=self._key(job_id),
+                                  Body=json.dumps({"job_id": job_id, "status": status,
+                                                   "result": result, "error": error}),
+                                  ContentType="application/json")
+
+    def get(self, job_id):
+        """
+        Returns the status, the result and the error of a job. Jobs not
+        picked up by a worker yet are QUEUED
+        """
+        try:
+            response = self.s3_client.get_object(Bucket=self.bucket_name, Key=self._key(job_id))
+        except ClientError as e:
+            if e.response["Error"]["Code"] not in ("NoSuchKey", "404"):
+                raise
+            return {"job_id": job_id, "status": "QUEUED", "result": None, "error": None}
+        return json.loads(response["Body"].read())
+
+
+class JobClient:
+    """
+    Submit jobs to the queue of the application, e.g. long generations, so
+    that they run on the worker service instead of in the Streamlit script
+    thread, and poll their results.
+    """
+
+    def __init__(self, queue_url=None, sqs_client=None, store=None):
+        self.queue_url = queue_url or os.environ["JOB_QUEUE_URL"]
+        self.sqs_client = sqs_client or boto3.client("sqs")
+        self.store = store or JobStore()
+
+    def submit(self, kind, payload):
+        """
+        Submit a job of a kind handled by the workers, with a JSON payload,
+        and returns its id. The payload is stored in the applications bucket,
+        only its key is sent to the queue
+        """
+        job_id = uuid.uuid4().hex
+        input_key = self.store.put_input(job_id, payload)
+        self.sqs_client.send_message(QueueUrl=self.queue_url,
+                                     MessageBody=json.dumps({"job_id": job_id, "kind": kind, "input_key": input_key}))
+        return job_id
+
+    def get(self, job_id):
+        """
+        Returns the status (QUEUED, RUNNING, COMPLETED or FAILED), the result
+        and the error of a job
+        """
+        return self.store.get(job_id)
+
+
+class JobWorker:
+    """
+    Receive the jobs of the queue of the application and run them with the
+    handler of their kind, a function of the payload returning a JSON
+    result. Up to max_concurrency jobs run at the same time.
+
+    While a job runs, the visibility timeout of its message is extended, so
+    that it is not received by another worker, for up to the 12 hours
+    allowed by SQS. A job whose handler raises is FAILED and is not retried.
+    A job whose worker stops before the end is received again once its
+    visibility timeout expires, and goes to the dead letter queue after a
+    few attempts.
+    """
+
+    def __init__(self, handlers, queue_url=None, sqs_client=None, store=None, max_concurrency=4,
+                 wait_time_seconds=20, visibility_timeout=None):
+        self.handlers = handlers
+        self.queue_url = queue_url or os.environ["JOB_QUEUE_URL"]
+        self.sqs_client = sqs_client or boto3.client("sqs")
+        self.store = store or JobStore()
+        self.max_concurrency = max_concurrency
+        self.wait_time_seconds = wait_time_seconds
+        self.visibility_timeout = visibility_timeout or int(os.environ.get("JOB_VISIBILITY_TIMEOUT", 900))
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency)
+
+    def _extend_visibility(self, message, done):
+        """
+        Extend the visibility timeout of the message of a running job, a third
+        of the timeout before it expires, until the job is done
+        """
+        while not done.wait(self.visibility_timeout / 3):
+            try:
+                self.sqs_client.change_message_visibility(QueueUrl=self.queue_url,
+                                                          ReceiptHandle=message["ReceiptHandle"],
+                                                          VisibilityTimeout=self.visibility_timeout)
+            except Exception as e:
+                print(f"Failed to extend the visibility of message {message.get('MessageId')}: {e!r}")
+
+    def _run_job(self, message):
+        job = json.loads(message["Body"])
+        job_id = job["job_id"]
+        start = time.perf_counter()
+        done = threading.Event()
+        threading.Thread(target=self._extend_visibility, args=(message, done), daemon=True).start()
+        try:
+            payload = self.store.get_input(job["input_key"])
+            self.store.put(job_id, "RUNNING")
+            try:
+                handler = self.handlers.get(job["kind"])
+                if handler is None:
+                    raise ValueError(f"No handler for the jobs of kind {job['kind']}")
+                self.store.put(job_id, "COMPLETED", result=handler(payload))
+            except Exception as e:
+                print(f"Job {job_id} failed: {e!r}")
+                self.store.put(job_id, "FAILED", error=repr(e))
+        finally:
+            done.set()
+        print(f"Job {job_id} ({job['kind']}) ran in {time.perf_counter() - start:.2f}s")
+        self.sqs_client.delete_message(QueueUrl=self.queue_url, ReceiptHandle=message["ReceiptHandle"])
+
+    def _process(self, message):
+        """
+        Run the job of a message. A message which cannot be run, e.g. not
+        valid JSON, stays in the queue: it is received again, and goes to the
+        dead letter queue after a few attempts
+        """
+        try:
+            self._run_job(message)
+        except Exception as e:
+            print(f"Failed to run the job of message {message.get('MessageId')}: {e!r}")
+
+    def _receive(self, max_messages):
+        return self.sqs_client.receive_message(
+            QueueUrl=self.queue_url,
+            MaxNumberOfMessages=min(max_messages, 10),
+            WaitTimeSeconds=self.wait_time_seconds,
+        ).get("Messages", [])
+
+    def run_once(self):
+        """
+        Receive a batch of jobs, run them and returns their number
+        """
+        messages = self._receive(self.max_concurrency)
+        list(self._executor.map(self._process, messages))
+        return len(messages)
+
+    def run(self, stop_event=None):
+        """
+        Run the jobs of the queue until stop_event is set. New jobs are
+        received as soon as a job ends, so that a long job does not hold the
+        others
+        """
+        stop_event = stop_event or threading.Event()
+        slots = threading.Semaphore(self.max_concurrency)
+        while not stop_event.is_set():
+            if not slots.acquire(timeout=1):
+                continue
+            free_slots = 1
+            while slots.acquire(blocking=False):
+                free_slots += 1
+            try:
+                messages = self._receive(free_slots)
+            except Exception as e:
+                print(f"Failed to receive the jobs: {e!r}")
+                messages = []
+                stop_event.wait(5)
+            for message in messages:
+                self._executor.submit(self._process, message).add_done_callback(lambda future: slots.release())
+            for _ in range(free_slots - len(messages)):
+                slots.release()
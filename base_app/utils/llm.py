@@ -1,29 +1,122 @@
 import boto3
+import io
 import json
+import os
+import random
+import threading
+import time
+from urllib.parse import unquote
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from botocore.config import Config
+from botocore.exceptions import ClientError
+from botocore.response import StreamingBody
+from utils.chunking import estimate_tokens, split_text
+from utils.metrics import Metrics
+from utils.throttling import TokenBucket
 
 
 class Llm:
 
-    def __init__(self):
-        # Create Bedrock client
-        bedrock_client = boto3.client(
-            'bedrock-runtime',
-            # If Bedrock is not activated in us-east-1 in your account, set this value
-            # accordingly
-            region_name='us-east-1',
-        )
-        self.bedrock_client = bedrock_client
+    # Prompt summarising a chunk of a text longer than the model context
+    SUMMARIZE_CHUNK_PROMPT = ("Here is an excerpt of a longer text:\n\n<text>\n{text}\n</text>\n\n"
+                              "Summarise this excerpt. Keep the key facts, names and figures.")
 
-    def invoke(self, input_text):
+    # Prompt combining the summaries of consecutive chunks of a text
+    COMBINE_SUMMARIES_PROMPT = ("Here are the summaries of consecutive parts of a longer text:\n\n"
+                                "<summaries>\n{summaries}\n</summaries>\n\n"
+                                "Combine them into a single summary of the text. Keep the key facts, "
+                                "names and figures.")
+
+    # Rate limiter of the Bedrock calls shared by all the sessions of the container
+    rate_limiter = TokenBucket()
+
+    # Metrics of the Bedrock calls, written on stdout in Embedded Metric Format
+    metrics = Metrics()
+
+    # Bedrock clients shared by all the sessions of the container, by region
+    _clients = {}
+    _clients_lock = threading.Lock()
+
+    @staticmethod
+    def get_client(region_name=None, retry=True):
+        """
+        Returns the Bedrock client of the region, created once per container.
+        The region and the connection settings come from the environment
+        variables set by the stack. The client retries the throttled calls
+        with client side rate limiting, unless retry is False, for the callers
+        retrying the calls themselves.
+        """
+        # If Bedrock is not activated in us-east-1 in your account, set the
+        # BEDROCK_REGION environment variable accordingly
+        region_name = region_name or os.environ.get("BEDROCK_REGION", "us-east-1")
+        if retry:
+            retries = {"mode": "adaptive", "max_attempts": int(os.environ.get("BEDROCK_MAX_ATTEMPTS", 5))}
+        else:
+            retries = {"mode": "standard", "total_max_attempts": 1}
+        with Llm._clients_lock:
+            if (region_name, retry) not in Llm._clients:
+                Llm._clients[(region_name, retry)] = boto3.client(
+                    'bedrock-runtime',
+                    region_name=region_name,
+                    config=Config(
+                        max_pool_connections=int(os.environ.get("BEDROCK_MAX_POOL_CONNECTIONS", 50)),
+                        retries=retries,
+                        connect_timeout=float(os.environ.get("BEDROCK_CONNECT_TIMEOUT", 5)),
+                        # Long generations take minutes before the last token
+                        read_timeout=float(os.environ.get("BEDROCK_READ_TIMEOUT", 300)),
+                        tcp_keepalive=True,
+                    ),
+                )
+                Llm._clients[(region_name, retry)].meta.events.register("needs-retry.bedrock-runtime",
+                                                                        Llm._count_throttles)
+            return Llm._clients[(region_name, retry)]
+
+    @staticmethod
+    def _count_throttles(response=None, request_dict=None, **kwargs):
         """
-        Make a call to the foundation model through Bedrock
+        Emit a Throttles metric for each throttled attempt of a call of the
+        shared clients, including the attempts retried by botocore
         """
+        if response is not None and response[1].get("Error", {}).get("Code") == "ThrottlingException":
+            # The path of the Bedrock runtime calls is /model/{modelId}/{operation}
+            model_id = unquote(request_dict["url_path"].split("/")[2])
+            Llm.metrics.emit({"Throttles": (1, "Count")}, dimensions={"ModelId": model_id})
 
-        # Prepare a Bedrock API call to invoke a foundation model
+    def __init__(self, bedrock_client=None, cache=None, rate_limiter=None, model_id=None, metrics=None):
+        # Use the shared Bedrock clients, unless one is given. invoke_many
+        # retries the throttled calls itself, with the shared rate limiter, so
+        # its client makes a single attempt per call
+        if bedrock_client is None:
+            self.bedrock_client = Llm.get_client()
+            self.batch_client = Llm.get_client(retry=False)
+        else:
+            self.bedrock_client = self.batch_client = bedrock_client
+        # The shared clients count their throttled attempts themselves
+        self._client_counts_throttles = bedrock_client is None
+
+        # Foundation model to invoke
+        self.model_id = model_id or os.environ.get("BEDROCK_MODEL_ID", "anthropic.claude-v2")
+
+        # Optional ResponseCache of the foundation model responses
+        self.cache = cache
+
+        if rate_limiter is not None:
+            self.rate_limiter = rate_limiter
+
+        if metrics is not None:
+            self.metrics = metrics
+
+        # Time to first token (in seconds) of the last call to stream()
+        self.last_time_to_first_token = None
+
+    def _build_request(self, input_text):
+        """
+        Prepare the parameters of a Bedrock API call to invoke a foundation model
+        """
         prompt = f"""\n\nHuman: {input_text}
                     \n\nAssistant:"""
 
-        model_id = "anthropic.claude-v2"
+        model_id = self.model_id
         body = {
             "prompt": prompt,
             "max_tokens_to_sample": 4096,
@@ -33,9 +126,233 @@ class Llm:
         accept = 'application/json'
         contentType = 'application/json'
 
+        return dict(body=body, modelId=model_id, accept=accept, contentType=contentType)
+
+    def _cache_key(self, request, use_cache):
+        if self.cache is None or not use_cache:
+            return None
+        return self.cache.key(request["modelId"], request["body"])
+
+    def _emit_call_metrics(self, start, cache_hit, input_tokens=None, output_tokens=None, time_to_first_token=None):
+        metrics = {
+            "Latency": ((time.perf_counter() - start) * 1000, "Milliseconds"),
+            "CacheHit": (int(cache_hit), "Count"),
+        }
+        if time_to_first_token is not None:
+            metrics["TimeToFirstToken"] = (time_to_first_token * 1000, "Milliseconds")
+        if input_tokens is not None:
+            metrics["InputTokens"] = (int(input_tokens), "Count")
+        if output_tokens is not None:
+            metrics["OutputTokens"] = (int(output_tokens), "Count")
+        self.metrics.emit(metrics, dimensions={"ModelId": self.model_id})
+
+    def _call_bedrock(self, operation, request):
+        try:
+            return operation(**request)
+        except ClientError as e:
+            if e.response["Error"]["Code"] == "ThrottlingException" and not self._client_counts_throttles:
+                self.metrics.emit({"Throttles": (1, "Count")}, dimensions={"ModelId": self.model_id})
+            raise
+
+    def invoke(self, input_text, use_cache=True):
+        """
+        Make a call to the foundation model through Bedrock.
+        Set use_cache to False to bypass the response cache.
+        """
+        return self._invoke(input_text, use_cache, self.bedrock_client)
+
+    def _invoke(self, input_text, use_cache, client, before_call=None):
+        start = time.perf_counter()
+        request = self._build_request(input_text)
+        cache_key = self._cache_key(request, use_cache)
+
+        if cache_key is not None:
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                self._emit_call_metrics(start, cache_hit=True)
+                body = json.dumps(cached).encode("utf-8")
+                return {"body": StreamingBody(io.BytesIO(body), len(body)), "cached": True}
+
         # Make the API call to Bedrock
-        response = self.bedrock_client.invoke_model(
-            body=body, modelId=model_id, accept=accept, contentType=contentType
-        )
+        if before_call is not None:
+            before_call()
+        response = self._call_bedrock(client.invoke_model, request)
+
+        headers = response.get("ResponseMetadata", {}).get("HTTPHeaders", {})
+        self._emit_call_metrics(start, cache_hit=False,
+                                input_tokens=headers.get("x-amzn-bedrock-input-token-count"),
+                                output_tokens=headers.get("x-amzn-bedrock-output-token-count"))
+
+        if cache_key is not None:
+            # The body can only be read once, so it is replaced by a copy
+            body = response["body"].read()
+            self.cache.put(cache_key, json.loads(body))
+            response["body"] = StreamingBody(io.BytesIO(body), len(body))
 
         return response
+
+    def stream(self, input_text, use_cache=True):
+        """
+        Make a streaming call to the foundation model through Bedrock
+        and yield the completion text chunk by chunk, as it is generated.
+        Set use_cache to False to bypass the response cache.
+        """
+        self.last_time_to_first_token = None
+        start = time.perf_counter()
+
+        request = self._build_request(input_text)
+        cache_key = self._cache_key(request, use_cache)
+
+        if cache_key is not None:
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                self.last_time_to_first_token = time.perf_counter() - start
+                self._emit_call_metrics(start, cache_hit=True, time_to_first_token=self.last_time_to_first_token)
+                yield cached["completion"]
+                return
+
+        # Make the API call to Bedrock
+        response = self._call_bedrock(self.bedrock_client.invoke_model_with_response_stream, request)
+
+        completion_chunks = []
+        stop_reason = None
+        invocation_metrics = {}
+
+        for event in response.get("body"):
+            chunk = event.get("chunk")
+            if chunk is None:
+                continue
+
+            payload = json.loads(chunk.get("bytes"))
+            completion = payload.get("completion", "")
+            stop_reason = payload.get("stop_reason") or stop_reason
+            # The last chunk holds the token counts of the call
+            invocation_metrics = payload.get("amazon-bedrock-invocationMetrics", invocation_metrics)
+            if self.last_time_to_first_token is None:
+                self.last_time_to_first_token = time.perf_counter() - start
+
+            completion_chunks.append(completion)
+            yield completion
+
+        self._emit_call_metrics(start, cache_hit=False,
+                                input_tokens=invocation_metrics.get("inputTokenCount"),
+                                output_tokens=invocation_metrics.get("outputTokenCount"),
+                                time_to_first_token=self.last_time_to_first_token)
+
+        # Only complete responses are cached
+        if cache_key is not None:
+            self.cache.put(cache_key, {"completion": "".join(completion_chunks), "stop_reason": stop_reason})
+
+    def _invoke_with_retries(self, input_text, use_cache, max_attempts, base_delay):
+        start = time.perf_counter()
+        result = {"completion": None, "error": None, "attempts": 0, "latency": None}
+
+        while True:
+            result["attempts"] += 1
+            try:
+                # Only the calls to Bedrock take a token of the rate limiter, not the cache hits
+                response = self._invoke(input_text, use_cache, self.batch_client,
+                                        before_call=self.rate_limiter.acquire)
+                result["completion"] = json.loads(response["body"].read())["completion"]
+                if not response.get("cached"):
+                    self.rate_limiter.on_success()
+                break
+            except ClientError as e:
+                throttled = e.response["Error"]["Code"] == "ThrottlingException"
+                if throttled:
+                    self.rate_limiter.on_throttle()
+                if not throttled or result["attempts"] >= max_attempts:
+                    result["error"] = e
+                    break
+                # Exponential backoff with full jitter
+                time.sleep(random.uniform(0, base_delay * 2 ** (result["attempts"] - 1)))
+            except Exception as e:
+                result["error"] = e
+                break
+
+        result["latency"] = time.perf_counter() - start
+        return result
+
+    def invoke_many(self, input_texts, max_concurrency=4, max_attempts=5, base_delay=0.5, use_cache=True,
+                    on_result=None):
+        """
+        Make concurrent calls to the foundation model through Bedrock, with at
+        most max_concurrency calls in flight.
+        Throttled calls are retried with exponential backoff, and slow down the
+        shared rate limiter. Returns, in the order of input_texts, a dict per
+        call with the completion, the error, the number of attempts and the
+        latency (in seconds). A failed call does not fail the whole batch.
+        on_result, if given, is called in the calling thread (e.g. the
+        Streamlit script thread) with the index and the result of each call,
+        as they complete.
+        """
+        results = [None] * len(input_texts)
+        with ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+            futures = {
+                executor.submit(self._invoke_with_retries, input_text, use_cache, max_attempts, base_delay): i
+                for i, input_text in enumerate(input_texts)
+            }
+            for future in as_completed(futures):
+                i = futures[future]
+                results[i] = future.result()
+                if on_result is not None:
+                    on_result(i, results[i])
+        return results
+
+    def _summarize_step(self, stage, prompts, max_concurrency, use_cache, progress):
+        done = []
+
+        def on_result(i, result):
+            done.append(i)
+            if progress is not None:
+                progress(stage, len(done), len(prompts))
+
+        results = self.invoke_many(prompts, max_concurrency=max_concurrency, use_cache=use_cache, on_result=on_result)
+        for result in results:
+            if result["error"] is not None:
+                raise result["error"]
+        return [result["completion"].strip() for result in results]
+
+    def summarize(self, text, chunk_tokens=2000, overlap_tokens=200, max_concurrency=4, use_cache=True,
+                  progress=None):
+        """
+        Summarise a text of any length with a map-reduce over the model.
+        The text is split in overlapping chunks of at most chunk_tokens
+        tokens, summarised in parallel, then the summaries are combined by
+        groups fitting in chunk_tokens, level by level, until one is left.
+        The calls go through the response cache, so summarising an edited
+        text only calls the model for the chunks around the edit and the
+        summaries combining them.
+        progress, if given, is called in the calling thread with the stage
+        ("map", then "reduce 1", "reduce 2"...), the number of calls done and
+        the number of calls of the stage.
+        """
+        chunks = split_text(text, max_tokens=chunk_tokens, overlap_tokens=overlap_tokens)
+        if not chunks:
+            return ""
+
+        summaries = self._summarize_step(
+            "map", [self.SUMMARIZE_CHUNK_PROMPT.format(text=chunk) for chunk in chunks],
+            max_concurrency, use_cache, progress)
+
+        level = 0
+        while len(summaries) > 1:
+            level += 1
+            # Group consecutive summaries within the budget, at least two per
+            # group so that every level reduces the number of summaries
+            groups = []
+            for summary in summaries:
+                if groups and (len(groups[-1]) < 2 or
+                               estimate_tokens("\n\n".join(groups[-1] + [summary])) <= chunk_tokens):
+                    groups[-1].append(summary)
+                else:
+                    groups.append([summary])
+            if len(groups[-1]) == 1 and len(groups) > 1:
+                groups[-2].extend(groups.pop())
+
+            summaries = self._summarize_step(
+                f"reduce {level}",
+                [self.COMBINE_SUMMARIES_PROMPT.format(summaries="\n\n".join(group)) for group in groups],
+                max_concurrency, use_cache, progress)
+
+        return summaries[0]
@@ -0,0 +1,61 @@
+import json
+import os
+import sys
+import threading
+import time
+
+
+class Metrics:
+    """
+    Writes metrics as CloudWatch Embedded Metric Format (EMF) lines on
+    stdout. The awslogs log driver of the container ships them to
+    CloudWatch Logs, which extracts them as CloudWatch metrics.
+
+    Metrics have an Application dimension, from the APPLICATION_NAME
+    environment variable, and are also published with the extra
+    dimensions given to emit().
+    """
+
+    NAMESPACE = "StreamlitApplications"
+
+    def __init__(self, namespace=NAMESPACE, application=None, stream=None, enabled=True):
+        self.namespace = namespace
+        self.application = application or os.environ.get("APPLICATION_NAME", "local")
+        self.stream = stream
+        self.enabled = enabled
+        self._lock = threading.Lock()
+
+    def emit(self, metrics, dimensions=None, properties=None):
+        """
+        Emit a dict of metrics, name -> (value, unit), with the extra
+        dimensions and the properties (not metrics, but searchable in the
+        logs) given as dicts
+        """
+        if not self.enabled or not metrics:
+            return
+
+        dimensions = dict(dimensions or {})
+        dimension_sets = [["Application"]]
+        if dimensions:
+            dimension_sets.append(["Application"] + list(dimensions))
+
+        document = {
+            "_aws": {
+                "Timestamp": int(time.time() * 1000),
+                "CloudWatchMetrics": [{
+                    "Namespace": self.namespace,
+                    "Dimensions": dimension_sets,
+                    "Metrics": [{"Name": name, "Unit": unit} for name, (value, unit) in metrics.items()],
+                }],
+            },
+            "Application": self.application,
+            **dimensions,
+            **(properties or {}),
+            **{name: value for name, (value, unit) in metrics.items()},
+        }
+
+        line = json.dumps(document)
+        with self._lock:
+            stream = self.stream or sys.stdout
+            stream.write(line + "\n")
+            stream.flush()
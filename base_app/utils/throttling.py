@@ -0,0 +1,60 @@
+import threading
+import time
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket limiting the rate of calls to a service.
+
+    The rate adapts to the throttling of the service: it is halved every
+    time a call is throttled and increased back additively on successful
+    calls, up to its initial value.
+    """
+
+    def __init__(self, rate=10., capacity=10, min_rate=0.5, increase=0.5,
+                 clock=time.monotonic, sleep=time.sleep):
+        self.rate = rate
+        self.max_rate = rate
+        self.min_rate = min_rate
+        self.increase = increase
+        self.capacity = capacity
+        self._tokens = capacity
+        self._clock = clock
+        self._sleep = sleep
+        self._updated_at = clock()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = self._clock()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.rate)
+        self._updated_at = now
+
+    def acquire(self):
+        """
+        Wait until a call is allowed
+        """
+        while True:
+            with self._lock:
+                self._refill()
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            self._sleep(wait)
+
+    def on_throttle(self):
+        """
+        Slow down after a call has been throttled by the service
+        """
+        with self._lock:
+            self._refill()
+            self.rate = max(self.min_rate, self.rate / 2)
+            self._tokens = min(self._tokens, 0)
+
+    def on_success(self):
+        """
+        Speed up again after a successful call
+        """
+        with self._lock:
+            self._refill()
+            self.rate = min(self.max_rate, self.rate + self.increase)
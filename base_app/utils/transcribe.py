@@ -0,0 +1,173 @@
+import boto3
+import json
+import os
+import queue
+import threading
+import time
+import uuid
+from boto3.s3.transfer import TransferConfig
+
+MB = 1024 * 1024
+
+
+class TranscriptionError(Exception):
+    """
+    Raised when a transcription job fails
+    """
+
+
+class TranscriptionJob:
+    """
+    Transcription job polled with exponential backoff in a background thread,
+    so that the Streamlit script thread is never blocked by the polling.
+
+    The transcript is delivered segment by segment through segments(), or
+    as a whole through wait(). status and done() can be checked on each
+    rerun without blocking, e.g. with the job kept in st.session_state.
+    """
+
+    def __init__(self, transcriber, job_name, output_key, initial_delay=1., max_delay=30.,
+                 timeout=4 * 3600, sleep=time.sleep):
+        self.transcriber = transcriber
+        self.job_name = job_name
+        self.output_key = output_key
+        self.initial_delay = initial_delay
+        self.max_delay = max_delay
+        self.timeout = timeout
+        self._sleep = sleep
+
+        self.status = "QUEUED"
+        self.error = None
+        self._segments = queue.Queue()
+        self._transcript = []
+        self._done = threading.Event()
+        self._thread = threading.Thread(target=self._poll, daemon=True)
+        self._thread.start()
+
+    def _poll(self):
+        delay = self.initial_delay
+        deadline = time.monotonic() + self.timeout
+        try:
+            while True:
+                job = self.transcriber.transcribe_client.get_transcription_job(
+                    TranscriptionJobName=self.job_name)["TranscriptionJob"]
+                self.status = job["TranscriptionJobStatus"]
+
+                if self.status == "COMPLETED":
+                    for segment in self.transcriber.read_transcript(self.output_key):
+                        self._transcript.append(segment)
+                        self._segments.put(segment)
+                    return
+                if self.status == "FAILED":
+                    raise TranscriptionError(f"Transcription job {self.job_name} failed: {job.get('FailureReason')}")
+                if time.monotonic() >= deadline:
+                    raise TranscriptionError(f"Transcription job {self.job_name} did not complete in {self.timeout}s")
+
+                self._sleep(delay)
+                delay = min(delay * 2, self.max_delay)
+        except Exception as e:
+            self.error = e
+        finally:
+            self._done.set()
+            self._segments.put(None)
+
+    def done(self):
+        """
+        Returns True once the job has completed or failed
+        """
+        return self._done.is_set()
+
+    def segments(self):
+        """
+        Yield the segments of the transcript as they are delivered, and raise
+        the error of the job if it failed
+        """
+        while True:
+            segment = self._segments.get()
+            if segment is None:
+                # Let other consumers see the end of the transcript too
+                self._segments.put(None)
+                break
+            yield segment
+
+        if self.error is not None:
+            raise self.error
+
+    def wait(self, timeout=None):
+        """
+        Wait for the job and returns the whole transcript
+        """
+        if not self._done.wait(timeout):
+            raise TimeoutError(f"Transcription job {self.job_name} is still {self.status}")
+        if self.error is not None:
+            raise self.error
+        return " ".join(self._transcript)
+
+
+class Transcriber:
+    """
+    Upload media files to the prefix of the application in the applications
+    bucket and transcribe them with Amazon Transcribe.
+
+    Uploads are streamed from the file object in parts sent concurrently,
+    without reading the whole file in memory first.
+    """
+
+    def __init__(self, bucket_name=None, prefix=None, s3_client=None, transcribe_client=None,
+                 max_concurrency=8, part_size=8 * MB):
+        self.bucket_name = bucket_name or os.environ["APPLICATION_BUCKET_NAME"]
+        self.prefix = prefix if prefix is not None else f"{os.environ.get('APPLICATION_NAME', 'local')}/"
+        self.s3_client = s3_client or boto3.client("s3")
+        self.transcribe_client = transcribe_client or boto3.client("transcribe")
+        self.transfer_config = TransferConfig(
+            multipart_threshold=part_size,
+            multipart_chunksize=part_size,
+            max_concurrency=max_concurrency,
+        )
+
+    def upload(self, fileobj, filename):
+        """
+        Upload a media file object (e.g. a Streamlit UploadedFile) and
+        returns its key in the bucket
+        """
+        key = f"{self.prefix}media/{uuid.uuid4().hex}/{os.path.basename(filename)}"
+        self.s3_client.upload_fileobj(fileobj, self.bucket_name, key, Config=self.transfer_config)
+        return key
+
+    def start(self, key, language_code=None, **poll_options):
+        """
+        Start the transcription job of an uploaded media file and returns the
+        TranscriptionJob polling it. The language is identified
+        automatically unless a language code is given.
+        """
+        job_name = f"{self.prefix.strip('/')}-{uuid.uuid4().hex}"
+        output_key = f"{self.prefix}transcripts/{job_name}.json"
+
+        language = {"LanguageCode": language_code} if language_code else {"IdentifyLanguage": True}
+        self.transcribe_client.start_transcription_job(
+            TranscriptionJobName=job_name,
+            Media={"MediaFileUri": f"s3://{self.bucket_name}/{key}"},
+            OutputBucketName=self.bucket_name,
+            OutputKey=output_key,
+            **language,
+        )
+
+        return TranscriptionJob(self, job_name, output_key, **poll_options)
+
+    def transcribe(self, fileobj, filename, language_code=None, **poll_options):
+        """
+        Upload a media file object and start its transcription job
+        """
+        return self.start(self.upload(fileobj, filename), language_code, **poll_options)
+
+    def read_transcript(self, output_key):
+        """
+        Returns the segments of the transcript written by a transcription job
+        """
+        response = self.s3_client.get_object(Bucket=self.bucket_name, Key=output_key)
+        results = json.loads(response["Body"].read())["results"]
+
+        audio_segments = results.get("audio_segments")
+        if audio_segments:
+            return [segment["transcript"] for segment in audio_segments]
+        return [transcript["transcript"] for transcript in results["transcripts"]]
@@ -0,0 +1,34 @@
+import json
+import os
+from utils.cache import ResponseCache
+from utils.jobs import JobWorker
+from utils.llm import Llm
+
+# Worker of the jobs submitted by the application in job mode, run by the
+# worker service from the same image as the application
+
+# Response cache shared with the application through the applications bucket
+response_cache = ResponseCache(
+    bucket_name=os.environ.get("APPLICATION_BUCKET_NAME"),
+    prefix=f"{os.environ.get('APPLICATION_NAME', 'local')}/",
+)
+
+
+def invoke(payload):
+    """
+    Generate the completion of an input text
+    """
+    response = Llm(cache=response_cache).invoke(payload["input_text"], use_cache=payload.get("use_cache", True))
+    return {"completion": json.loads(response["body"].read())["completion"]}
+
+
+def summarize(payload):
+    """
+    Summarise a text of any length
+    """
+    summary = Llm(cache=response_cache).summarize(payload["text"], use_cache=payload.get("use_cache", True))
+    return {"summary": summary}
+
+
+if __name__ == "__main__":
+    JobWorker(handlers={"invoke": invoke, "summarize": summarize}).run()
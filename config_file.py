@@ -1,3 +1,82 @@
+from dataclasses import dataclass
+from typing import Optional
+
+
+@dataclass(frozen=True)
+class ApplicationConfig:
+    # Name of the application, used in its path and in the resource names
+    name: str
+    # Folder with the source code of the application, used to build its
+    # initial image and to initialise its repository
+    source_directory: str = "base_app"
+    # Fargate task size
+    cpu: int = 256
+    memory_limit_mib: int = 512
+    # Bounds of the number of tasks of the service
+    min_tasks: int = 1
+    max_tasks: int = 4
+    # Target tracking scaling targets: average CPU utilization (in percent)
+    # and ALB requests per target per minute
+    cpu_target_utilization: int = 70
+    requests_per_target: int = 500
+    # Explicit priority of the ALB listener rule of the application, between
+    # 1 and 50000. When not set, a stable priority is derived from the name
+    listener_priority: Optional[int] = None
+    # CPU architecture of the tasks, "X86_64" or "ARM64" (Graviton)
+    cpu_architecture: str = "X86_64"
+    # Capacity provider strategy of the service. With a FARGATE_SPOT weight of
+    # 0 the tasks run on on-demand Fargate only. The base number of tasks
+    # always runs on on-demand Fargate. FARGATE_SPOT does not run ARM64 tasks
+    fargate_weight: int = 1
+    fargate_spot_weight: int = 0
+    fargate_base: int = 1
+    # Region and foundation model of the Bedrock calls of the application
+    bedrock_region: str = "us-east-1"
+    bedrock_model_id: str = "anthropic.claude-v2"
+    # Alarm thresholds (in milliseconds) on the p95 latency of the foundation
+    # model calls and on the p95 duration of the Streamlit script reruns
+    latency_alarm_threshold_ms: int = 30000
+    rerun_alarm_threshold_ms: int = 60000
+    # Shard of the application when Config.SHARD_COUNT is set. When not set,
+    # a stable shard is derived from the name
+    shard: Optional[int] = None
+    # Job mode: the application submits its long generations to an SQS queue,
+    # they run on a separate worker service scaled on the depth of the queue,
+    # and their results are written under the prefix of the application
+    job_mode: bool = False
+    # Fargate task size and bounds of the number of tasks of the worker service
+    worker_cpu: int = 512
+    worker_memory_limit_mib: int = 1024
+    worker_min_tasks: int = 0
+    worker_max_tasks: int = 4
+
+    @staticmethod
+    def from_entry(entry):
+        """
+        Returns the ApplicationConfig of an entry of the application list,
+        which is either an ApplicationConfig or the name of the application
+        """
+        if isinstance(entry, ApplicationConfig):
+            return entry
+        return ApplicationConfig(name=entry)
+
+
 class Config:
-    # ID of Secrets Manager containing cognito parameters
-    APPLICATION_LIST = ["video-summarisation"]
+    # Applications to deploy, either names or ApplicationConfig objects. New
+    # applications are appended, so that they keep the listener priorities
+    # of the applications already deployed
+    APPLICATION_LIST = [ApplicationConfig(name="video-summarisation")]
+    # Number of shards, each with its own ALB and CloudFront distribution,
+    # the applications are spread across. 0 deploys all the applications
+    # behind a single ALB
+    SHARD_COUNT = 0
+    # Number of NAT gateways of the VPC, None for one per availability zone.
+    # With 0, the tasks reach AWS services through the VPC endpoints only,
+    # which requires VPC_ENDPOINTS, and cannot reach the other services, e.g.
+    # Cognito for the login of base_app
+    NAT_GATEWAYS = None
+    # Gateway endpoint of S3 and interface endpoints of ECR, Secrets Manager,
+    # Bedrock runtime, Transcribe, CloudWatch Logs (and SQS in job mode), so
+    # that the traffic of the tasks to these services does not go through
+    # the NAT gateways
+    VPC_ENDPOINTS = False
@@ -10,6 +10,7 @@ from aws_cdk import (
     aws_secretsmanager as secretsmanager,
     aws_ecs as ecs,
     aws_ecr as ecr,
+    aws_ecr_assets as ecr_assets,
     aws_elasticloadbalancingv2 as elbv2,
     aws_ec2 as ec2,
     aws_s3 as s3,
@@ -17,23 +18,55 @@ from aws_cdk import (
     aws_iam as iam,
     aws_cloudfront as cloudfront,
     aws_cloudfront_origins as origins,
+    aws_cloudwatch as cloudwatch,
     SecretValue,
-    CfnOutput
-
-    # aws_sqs as sqs,
+    CfnOutput,
+    aws_sqs as sqs,
 )
 import os
 from constructs import Construct
 
-from config_file import Config
+from config_file import Config, ApplicationConfig
 from utils.helpers import helpers
 
 CUSTOM_HEADER_NAME = "X-Custom-Header"
 CUSTOM_HEADER_VALUE = "sdmlkfsdmlkf"
 
+#immutable static assets of the streamlit applications, cached at the edge
+#the patterns match the paths of every application, /{app_name}/static/* and /{app_name}/favicon.png,
+#so that the number of cache behaviors of a distribution does not grow with the number of applications
+#the websocket (/{app_name}/_stcore/stream) and the other paths stay on the uncached default behavior
+STATIC_PATH_PATTERNS = ["/*/static/*", "/*/favicon.png"]
+
+#namespace of the metrics emitted by the applications in embedded metric format (see base_app/utils/metrics.py)
+APPLICATION_METRICS_NAMESPACE = "StreamlitApplications"
+
+#number of applications per shard, to stay under the limit of 100 rules per ALB listener
+#and under the limits of resources and outputs per CloudFormation stack
+MAX_APPLICATIONS_PER_SHARD = 90
+
+#platforms of the tasks, of the initial image and of the pipeline build for each CPU architecture
+CPU_ARCHITECTURES = {
+    "X86_64": (ecs.CpuArchitecture.X86_64, ecr_assets.Platform.LINUX_AMD64, codebuild.LinuxBuildImage.STANDARD_5_0),
+    "ARM64": (ecs.CpuArchitecture.ARM64, ecr_assets.Platform.LINUX_ARM64, codebuild.LinuxArmBuildImage.AMAZON_LINUX_2_STANDARD_3_0),
+}
+
+#interface endpoints of the services called by the tasks, by construct id, when the VPC endpoints are enabled
+#s3 has a gateway endpoint instead, on the route tables of the subnets of the tasks
+#the bedrock runtime endpoint serves the region of the stack, apps with another bedrock region go through the NAT gateways
+VPC_INTERFACE_ENDPOINTS = {
+    "EcrApi": ec2.InterfaceVpcEndpointAwsService.ECR,
+    "EcrDocker": ec2.InterfaceVpcEndpointAwsService.ECR_DOCKER,
+    "SecretsManager": ec2.InterfaceVpcEndpointAwsService.SECRETS_MANAGER,
+    "BedrockRuntime": ec2.InterfaceVpcEndpointAwsService("bedrock-runtime"),
+    "Transcribe": ec2.InterfaceVpcEndpointAwsService.TRANSCRIBE,
+    "Logs": ec2.InterfaceVpcEndpointAwsService.CLOUDWATCH_LOGS,
+}
+
 class StreamlitApplicationManagerStack(Stack):
 
-    def __init__(self, scope: Construct, construct_id: str, **kwargs) -> None:
+    #the applications to deploy come from the Config class of the config file, unless another config is given
+    def __init__(self, scope: Construct, construct_id: str, config: type = Config, **kwargs) -> None:
         super().__init__(scope, construct_id, **kwargs)
 
 
@@ -63,141 +96,294 @@ class StreamlitApplicationManagerStack(Stack):
 
 
 
+        app_configs = [ApplicationConfig.from_entry(app_entry) for app_entry in config.APPLICATION_LIST]
+
         # Deploy an ECS Cluster named "StreamLit Cluster in a new VPC on 2 AZ
+        # FARGATE and FARGATE_SPOT capacity providers are available to the services
         cluster = ecs.Cluster(self, "StreamlitApplicationsCluster",
-                              vpc=ec2.Vpc(self, "StreamlitApplicationsVPC", max_azs=2),
-                              cluster_name="StreamlitApplicationsCluster")
+                              vpc=create_vpc(self, config, app_configs),
+                              cluster_name="StreamlitApplicationsCluster",
+                              enable_fargate_capacity_providers=True)
 
 
-        #create an ALB that will connect to the cluster services and will be accessed through a cloudfront distribution
-        alb = elbv2.ApplicationLoadBalancer(self, "StreamlitApplicationsALB",
-                                      vpc=cluster.vpc,
-                                      internet_facing=True,
-                                      load_balancer_name="StreamlitApplications-alb")
-        
-
-        # Add ALB as CloudFront Origin
-        origin = origins.LoadBalancerV2Origin(
-            alb,
-            custom_headers={CUSTOM_HEADER_NAME: CUSTOM_HEADER_VALUE},
-            origin_shield_enabled=False,
-            protocol_policy=cloudfront.OriginProtocolPolicy.HTTP_ONLY,
-        )
+        #create a S3 bucket for applications content
+        application_content_bucket = s3.Bucket(self, "StreamlitApplicationsBucket",
+                            removal_policy=RemovalPolicy.DESTROY,
+                            auto_delete_objects=True)
 
-        cloudfront_distribution = cloudfront.Distribution(
-                    self,
-                    f"StreamlitApplicationsCfDist",
-                    default_behavior=cloudfront.BehaviorOptions(
-                        origin=origin,
-                        viewer_protocol_policy=cloudfront.ViewerProtocolPolicy.REDIRECT_TO_HTTPS,
-                        allowed_methods=cloudfront.AllowedMethods.ALLOW_ALL,
-                        cache_policy=cloudfront.CachePolicy.CACHING_DISABLED,
-                        origin_request_policy=cloudfront.OriginRequestPolicy.ALL_VIEWER,
-                    ),
+        #initial images of the applications, built and published once per source folder and CPU architecture
+        image_assets = {}
+        for app_config in app_configs:
+            image_key = (app_config.source_directory, app_config.cpu_architecture)
+            if image_key not in image_assets:
+                image_assets[image_key] = ecr_assets.DockerImageAsset(
+                    self, f"{app_config.source_directory.strip('/').replace('/', '-')}-{app_config.cpu_architecture}-Image",
+                    directory=app_config.source_directory,
+                    platform=CPU_ARCHITECTURES[app_config.cpu_architecture][1],
                 )
 
+        #cache policy of the static assets of the applications, shared by all the cloudfront distributions
+        static_cache_policy = cloudfront.CachePolicy(self, "StreamlitApplicationsStaticCachePolicy",
+                                    comment="Static assets of the Streamlit applications",
+                                    default_ttl=Duration.days(1),
+                                    min_ttl=Duration.seconds(0),
+                                    max_ttl=Duration.days(365),
+                                    enable_accept_encoding_gzip=True,
+                                    enable_accept_encoding_brotli=True,
+                                    )
 
-        #create a listener on the ALB that will forward traffic to the cluster services
-        listener = alb.add_listener("StreamlitApplicationsListener",
-                                    port=80,
-                                    open=True)
-        #create a default action for the listener that return 404 error
-        listener.add_action("DefaultAction",
-                            action=elbv2.ListenerAction.fixed_response(status_code=404))
+        if not config.SHARD_COUNT:
+            #all the applications are behind the ALB and the cloudfront distribution of this stack
+            add_streamlit_applications(self, app_configs, image_assets, cluster, secret, application_content_bucket,
+                                       static_cache_policy)
+        else:
+            #the applications are spread across shards, each with its own ALB and cloudfront distribution
+            for shard, shard_app_configs in enumerate(helpers.allocate_shards(app_configs, config.SHARD_COUNT, MAX_APPLICATIONS_PER_SHARD)):
+                shard_stack = StreamlitApplicationShardStack(self, f"StreamlitApplicationsShard{shard}Stack",
+                                    shard=shard,
+                                    app_configs=shard_app_configs,
+                                    image_assets=image_assets,
+                                    StreamlitCluster=cluster,
+                                    secret=secret,
+                                    static_cache_policy=static_cache_policy,
+                                    application_bucket=application_content_bucket
+                                    )
 
-        #create a S3 bucket for applications content
-        application_content_bucket = s3.Bucket(self, "StreamlitApplicationsBucket",
-                            removal_policy=RemovalPolicy.DESTROY,
-                            auto_delete_objects=True)
+                CfnOutput(
+                    self, f"shard{shard}_url",
+                    value=shard_stack.cloudfront_distribution.domain_name,
+                    description="url of the applications of the shard",
+                )
 
+        CfnOutput(
+            self, f"userPoolId",
+            value=f"aws cognito-idp admin-create-user --user-pool-id {user_pool.user_pool_id} --username admin --temporary-password admin12345",
+            description="to create a first user",
+        )
         
-        # Grant access to Bedrock
-        bedrock_policy = iam.Policy(self, "StreamlitApplicationsBedrockPolicy",
+
+
+#this function creates the VPC of the cluster, with the number of NAT gateways of the config
+#without NAT gateway, the subnets of the tasks are isolated and the tasks reach AWS services through the VPC endpoints only
+#the VPC endpoints, when enabled, are in the subnets of the tasks
+def create_vpc(scope: Construct, config: type, app_configs) -> ec2.Vpc:
+    vpc_options = {}
+    if config.NAT_GATEWAYS is not None:
+        vpc_options["nat_gateways"] = config.NAT_GATEWAYS
+    if config.NAT_GATEWAYS == 0:
+        if not config.VPC_ENDPOINTS:
+            raise ValueError("NAT_GATEWAYS = 0 requires VPC_ENDPOINTS, the tasks could not pull their images")
+        vpc_options["subnet_configuration"] = [
+            ec2.SubnetConfiguration(name="Public", subnet_type=ec2.SubnetType.PUBLIC),
+            ec2.SubnetConfiguration(name="Private", subnet_type=ec2.SubnetType.PRIVATE_ISOLATED),
+        ]
+
+    vpc = ec2.Vpc(scope, "StreamlitApplicationsVPC", max_azs=2, **vpc_options)
+
+    if config.VPC_ENDPOINTS:
+        task_subnets = ec2.SubnetSelection(subnet_type=ec2.SubnetType.PRIVATE_ISOLATED if config.NAT_GATEWAYS == 0
+                                           else ec2.SubnetType.PRIVATE_WITH_EGRESS)
+        #image layers are pulled from s3
+        vpc.add_gateway_endpoint("S3Endpoint", service=ec2.GatewayVpcEndpointAwsService.S3, subnets=[task_subnets])
+
+        interface_endpoints = dict(VPC_INTERFACE_ENDPOINTS)
+        if any(app_config.job_mode for app_config in app_configs):
+            interface_endpoints["Sqs"] = ec2.InterfaceVpcEndpointAwsService.SQS
+        for endpoint_id, service in interface_endpoints.items():
+            vpc.add_interface_endpoint(f"{endpoint_id}Endpoint", service=service, subnets=task_subnets,
+                                       private_dns_enabled=True)
+
+    return vpc
+
+
+
+#this function creates the ALB, the cloudfront distribution and the streamlit applications in a scope
+#the scope is either the main stack, or a shard stack when the applications are sharded
+#each application is a nested stack routed by the ALB listener on its path
+#in a shard, the outputs of each application are in its own nested stack, to stay under the outputs limit of the shard stack
+def add_streamlit_applications(scope: Construct, app_configs, image_assets, cluster: ecs.Cluster,
+                           secret: secretsmanager.ISecret, application_content_bucket: s3.IBucket,
+                           static_cache_policy: cloudfront.ICachePolicy,
+                           load_balancer_name: str = "StreamlitApplications-alb", sharded: bool = False):
+
+    #create an ALB that will connect to the cluster services and will be accessed through a cloudfront distribution
+    alb = elbv2.ApplicationLoadBalancer(scope, "StreamlitApplicationsALB",
+                                  vpc=cluster.vpc,
+                                  internet_facing=True,
+                                  load_balancer_name=load_balancer_name)
+    
+
+    # Add ALB as CloudFront Origin
+    origin = origins.LoadBalancerV2Origin(
+        alb,
+        custom_headers={CUSTOM_HEADER_NAME: CUSTOM_HEADER_VALUE},
+        origin_shield_enabled=False,
+        protocol_policy=cloudfront.OriginProtocolPolicy.HTTP_ONLY,
+    )
+
+    cloudfront_distribution = cloudfront.Distribution(
+                scope,
+                f"StreamlitApplicationsCfDist",
+                default_behavior=cloudfront.BehaviorOptions(
+                    origin=origin,
+                    viewer_protocol_policy=cloudfront.ViewerProtocolPolicy.REDIRECT_TO_HTTPS,
+                    allowed_methods=cloudfront.AllowedMethods.ALLOW_ALL,
+                    cache_policy=cloudfront.CachePolicy.CACHING_DISABLED,
+                    origin_request_policy=cloudfront.OriginRequestPolicy.ALL_VIEWER,
+                ),
+            )
+
+    #cache the static assets of the applications at the edge
+    for path_pattern in STATIC_PATH_PATTERNS:
+        cloudfront_distribution.add_behavior(path_pattern, origin,
+                    viewer_protocol_policy=cloudfront.ViewerProtocolPolicy.REDIRECT_TO_HTTPS,
+                    allowed_methods=cloudfront.AllowedMethods.ALLOW_GET_HEAD,
+                    cache_policy=static_cache_policy,
+                    compress=True,
+                    )
+
+
+    #create a listener on the ALB that will forward traffic to the cluster services
+    listener = alb.add_listener("StreamlitApplicationsListener",
+                                port=80,
+                                open=True)
+    #create a default action for the listener that return 404 error
+    listener.add_action("DefaultAction",
+                        action=elbv2.ListenerAction.fixed_response(status_code=404))
+
+    
+    # Grant access to Bedrock
+    bedrock_policy = iam.Policy(scope, "StreamlitApplicationsBedrockPolicy",
+                                statements=[
+                                    iam.PolicyStatement(
+                                        actions=["bedrock:InvokeModel",
+                                                 "bedrock:InvokeModelWithResponseStream"],
+                                        resources=["*"]
+                                    )
+                                ]
+                                )
+    
+    #grant access to transcribe
+    transcribe_policy = iam.Policy(scope, "StreamlitApplicationsTranscribePolicy",
                                     statements=[
                                         iam.PolicyStatement(
-                                            actions=["bedrock:InvokeModel"],
+                                            actions=["transcribe:StartTranscriptionJob",    
+                                                     "transcribe:UntagResource",
+                                                    "transcribe:GetTranscriptionJob",
+                                                    "transcribe:TagResource",
+                                                    "transcribe:StartTranscriptionJob",
+                                                    "transcribe:ListTranscriptionJobs",
+                                                    "transcribe:ListTagsForResource"],
                                             resources=["*"]
                                         )
                                     ]
                                     )
+    
+    myNestedStacks = []
+
+    #allocate a stable and unique listener rule priority to each application
+    listener_priorities = helpers.allocate_priorities(
+        [app_config.name for app_config in app_configs],
+        {app_config.name: app_config.listener_priority for app_config in app_configs
+         if app_config.listener_priority is not None}
+    )
+
+    #for each application in the config file, we create an app and add a trarget rule
+    for i,app_config in enumerate(app_configs):
+        app_name = app_config.name
+
+        #create a stack with the streamlit application
+        myNestedStack = StreamlitApplicationStack(scope, f"{app_name}Stack",
+                                app_config=app_config,
+                                image_asset=image_assets[(app_config.source_directory, app_config.cpu_architecture)],
+                                StreamlitCluster=cluster,
+                                application_bucket=application_content_bucket
+                                )
         
-        #grant access to transcribe
-        transcribe_policy = iam.Policy(self, "StreamlitApplicationsTranscribePolicy",
-                                        statements=[
-                                            iam.PolicyStatement(
-                                                actions=["transcribe:StartTranscriptionJob",    
-                                                         "transcribe:UntagResource",
-                                                        "transcribe:GetTranscriptionJob",
-                                                        "transcribe:TagResource",
-                                                        "transcribe:StartTranscriptionJob",
-                                                        "transcribe:ListTranscriptionJobs",
-                                                        "transcribe:ListTagsForResource"],
-                                                resources=["*"]
-                                            )
-                                        ]
-                                        )
+        #create a path based routing rule on the listener that will forward traffic to the service
+        #sessions are sticky as Streamlit websocket sessions are bound to a task
+        target_group = listener.add_targets(app_name,
+                            target_group_name=app_name,
+                            port=8501,
+                            priority=listener_priorities[app_name],
+                            health_check=elbv2.HealthCheck(path=f'/{app_name}/'),
+                            conditions=[
+                                elbv2.ListenerCondition.http_header(CUSTOM_HEADER_NAME,[CUSTOM_HEADER_VALUE]),
+                                elbv2.ListenerCondition.path_patterns([f"/{app_name}/*"])
+                                ],
+                                protocol=elbv2.ApplicationProtocol.HTTP,
+                                targets=[myNestedStack.service],
+                                stickiness_cookie_duration=Duration.days(1)
+                            
+        )
+
+        #scale the service on the number of requests per task
+        myNestedStack.scalable_target.scale_on_request_count(f"{app_name}RequestCountScaling",
+                                requests_per_target=app_config.requests_per_target,
+                                target_group=target_group
+                                )
+
+        myNestedStack.service.task_definition.task_role.attach_inline_policy(bedrock_policy)
+        myNestedStack.service.task_definition.task_role.attach_inline_policy(transcribe_policy)
+
+        # Grant access to read the secret in Secrets Manager
+        secret.grant_read(myNestedStack.service.task_definition.task_role)
         
-        myNestedStacks = []
-
-        #for each application in the config file, we create an app and add a trarget rule
-        for i,app_name in enumerate(Config.APPLICATION_LIST):
-            #create a stack with the streamlit application
-            myNestedStack = StreamlitApplicationStack(self, f"{app_name}Stack",
-                                    app_name=app_name,
-                                    StreamlitCluster=cluster
-                                    )
-            
-            #create a path based routing rule on the listener that will forward traffic to the service
-            listener.add_targets(app_name,
-                                target_group_name=app_name,
-                                port=8501,
-                                priority=helpers.get_hash(app_name),
-                                health_check=elbv2.HealthCheck(path=f'/{app_name}/'),
-                                conditions=[
-                                    elbv2.ListenerCondition.http_header(CUSTOM_HEADER_NAME,[CUSTOM_HEADER_VALUE]),
-                                    elbv2.ListenerCondition.path_patterns([f"/{app_name}/*"])
-                                    ],
-                                    protocol=elbv2.ApplicationProtocol.HTTP,
-                                    targets=[myNestedStack.service]
-                                
-            )
+        # Grant access to write to the bucket
+        application_content_bucket.grant_read_write(myNestedStack.service.task_definition.task_role, f"{app_name}/*")
+
+        #the worker service of the jobs calls bedrock and writes the results of the jobs in the prefix of the app
+        if myNestedStack.worker_service is not None:
+            worker_role = myNestedStack.worker_service.task_definition.task_role
+            worker_role.attach_inline_policy(bedrock_policy)
+            application_content_bucket.grant_read_write(worker_role, f"{app_name}/*")
+        
+        myNestedStacks.append(myNestedStack)
 
-            myNestedStack.service.task_definition.task_role.attach_inline_policy(bedrock_policy)
-            myNestedStack.service.task_definition.task_role.attach_inline_policy(transcribe_policy)
-
-            # Grant access to read the secret in Secrets Manager
-            secret.grant_read(myNestedStack.service.task_definition.task_role)
-            
-            # Grant access to write to the bucket
-            application_content_bucket.grant_read_write(myNestedStack.service.task_definition.task_role, f"{app_name}/*")
-            
-            myNestedStacks.append(myNestedStack)
-
-        for stack in myNestedStacks:
-            CfnOutput(
-                self, f"{stack.app_name}_url",
-                value=f"{cloudfront_distribution.domain_name}/{stack.app_name}/",
-                description="url of the application",
-            )
+    for stack in myNestedStacks:
+        output_scope = stack if sharded else scope
 
-            CfnOutput(
-                self, f"{stack.app_name}_repository",
-                value=f"git clone {stack.codecommitrepo.repository_clone_url_grc}",
-                description="to clone the application",
-            )
+        CfnOutput(
+            output_scope, f"{stack.app_name}_url",
+            value=f"{cloudfront_distribution.domain_name}/{stack.app_name}/",
+            description="url of the application",
+        )
 
-            CfnOutput(
-                self, f"{stack.app_name}_bucket",
-                value=f"{application_content_bucket.bucket_name}/{stack.app_name}/",
-                description="Bucket and prefix for the app"
-            )
+        CfnOutput(
+            output_scope, f"{stack.app_name}_repository",
+            value=f"git clone {stack.codecommitrepo.repository_clone_url_grc}",
+            description="to clone the application",
+        )
 
         CfnOutput(
-            self, f"userPoolId",
-            value=f"aws cognito-idp admin-create-user --user-pool-id {user_pool.user_pool_id} --username admin --temporary-password admin12345",
-            description="to create a first user",
+            output_scope, f"{stack.app_name}_bucket",
+            value=f"{application_content_bucket.bucket_name}/{stack.app_name}/",
+            description="Bucket and prefix for the app"
         )
-        
+
+    return cloudfront_distribution, myNestedStacks
+
+
+
+class StreamlitApplicationShardStack(NestedStack):
+
+    #in this stack, we create a shard of the streamlit applications
+    #the shard has its own ALB, listener and cloudfront distribution, so that the number of listener rules
+    #and of resources of each stack stay under the service limits when there are many applications
+    #adding an application only updates the stack of its shard
+    def __init__(self, scope: Construct, construct_id: str, shard: int, app_configs, image_assets,
+                 StreamlitCluster: ecs.Cluster, secret: secretsmanager.ISecret,
+                 static_cache_policy: cloudfront.ICachePolicy,
+                 application_bucket: s3.IBucket, **kwargs) -> None:
+        super().__init__(scope, construct_id, **kwargs)
+
+        cloudfront_distribution, app_stacks = add_streamlit_applications(
+            self, app_configs, image_assets, StreamlitCluster, secret, application_bucket, static_cache_policy,
+            load_balancer_name=f"StreamlitApplications-alb-{shard}", sharded=True)
+
+        self.shard = shard
+        self.cloudfront_distribution = cloudfront_distribution
+        self.app_stacks = app_stacks
 
 
 
@@ -206,29 +392,68 @@ class StreamlitApplicationStack(NestedStack):
     #in this stack, we create a fargate service with the same name than the stack
     #the service is on the ECS cluster of the main stack
     #the service is initialized with an ECR image created from the source code in the base_app folder
+    #this image asset is created by the main stack and shared by the apps with the same source folder
     #the ECR repository is created in the main stack
     #the service is configured to run on port 8501
     #the service is accessible from the ALB of the main stack using a path equal to the service name
     #the stack also create a code commit repository with the base_app source code that will deploy in the service
     #the service shall not have a public IP address
-    def __init__(self, scope: Construct, construct_id: str, app_name: str, StreamlitCluster: ecs.Cluster, **kwargs) -> None:
+    #the name of the applications bucket and the prefix of the app are passed to the container
+    #the task size and the autoscaling bounds of the service come from the app config
+    #the tasks run on the CPU architecture and on the capacity providers of the app config
+    #the stack also creates a dashboard and p95 latency alarms from the metrics emitted by the application
+    #in job mode, the stack also creates the queue of the jobs of the application and a worker service running them,
+    #from the same image, scaled on the number of jobs in the queue
+    def __init__(self, scope: Construct, construct_id: str, app_config: ApplicationConfig,
+                 image_asset: ecr_assets.DockerImageAsset, StreamlitCluster: ecs.Cluster,
+                 application_bucket: s3.IBucket, **kwargs) -> None:
         super().__init__(scope, construct_id, **kwargs)
 
+        app_name = app_config.name
+        cpu_architecture, _, build_image = CPU_ARCHITECTURES[app_config.cpu_architecture]
+
         fargate_task_definition = ecs.FargateTaskDefinition(
             self,
             f"{app_name}TaskDefinition",
-            memory_limit_mib=512,
-            cpu=256,
+            memory_limit_mib=app_config.memory_limit_mib,
+            cpu=app_config.cpu,
+            runtime_platform=ecs.RuntimePlatform(
+                cpu_architecture=cpu_architecture,
+                operating_system_family=ecs.OperatingSystemFamily.LINUX,
+            ),
         )
 
-        # Build Dockerfile from local folder 
-        image = ecs.ContainerImage.from_asset(directory='base_app',asset_name=app_name)
+        # Image built from the Dockerfile of the local folder
+        image = ecs.ContainerImage.from_docker_image_asset(image_asset)
+
+        environment = {
+            "APPLICATION_NAME": app_name,
+            "APPLICATION_BUCKET_NAME": application_bucket.bucket_name,
+            "BEDROCK_REGION": app_config.bedrock_region,
+            "BEDROCK_MODEL_ID": app_config.bedrock_model_id,
+        }
+
+        #queue of the jobs of the application, the jobs failing repeatedly end up in a dead letter queue
+        job_queue = None
+        if app_config.job_mode:
+            job_dead_letter_queue = sqs.Queue(self, f"{app_name}JobDeadLetterQueue",
+                                              retention_period=Duration.days(14))
+            #the workers extend the visibility timeout of the running jobs, up to the 12 hours allowed by SQS,
+            #so the timeout is the delay before the job of a stopped worker is received again
+            job_visibility_timeout = Duration.minutes(15)
+            job_queue = sqs.Queue(self, f"{app_name}JobQueue",
+                                  visibility_timeout=job_visibility_timeout,
+                                  dead_letter_queue=sqs.DeadLetterQueue(queue=job_dead_letter_queue,
+                                                                        max_receive_count=3))
+            environment["JOB_QUEUE_URL"] = job_queue.queue_url
+            environment["JOB_VISIBILITY_TIMEOUT"] = str(int(job_visibility_timeout.to_seconds()))
 
         fargate_task_definition.add_container(
             f"{app_name}-Container",            
             image=image,
             environment={
-                "STREAMLIT_SERVER_BASE_URL_PATH":f"/{app_name}"
+                "STREAMLIT_SERVER_BASE_URL_PATH":f"/{app_name}",
+                **environment,
             },
             port_mappings=[
                 ecs.PortMapping(
@@ -238,15 +463,92 @@ class StreamlitApplicationStack(NestedStack):
         )
 
 
+        #mix on-demand and spot capacity when the app accepts spot tasks
+        #Fargate Spot does not run ARM64 tasks
+        capacity_provider_strategies = None
+        if app_config.fargate_spot_weight > 0:
+            if app_config.cpu_architecture == "ARM64":
+                raise ValueError(f"FARGATE_SPOT does not support the ARM64 tasks of {app_name}, "
+                                 f"set its fargate_spot_weight to 0 or its cpu_architecture to X86_64")
+            capacity_provider_strategies = [
+                ecs.CapacityProviderStrategy(capacity_provider="FARGATE",
+                                             weight=app_config.fargate_weight,
+                                             base=app_config.fargate_base),
+                ecs.CapacityProviderStrategy(capacity_provider="FARGATE_SPOT",
+                                             weight=app_config.fargate_spot_weight),
+            ]
+
         #create an ECS service from the repository
         service = ecs.FargateService(self, f"{app_name}Service",
                                      cluster=StreamlitCluster,
                                      task_definition=fargate_task_definition,
                                      assign_public_ip=False,
                                      service_name=app_name,
-                                     desired_count=1,                                     
+                                     capacity_provider_strategies=capacity_provider_strategies,
                                      )
+
+        #scale the service between the min and max number of tasks, on the CPU utilization
+        #the service has no desired count, so that a deployment does not reset the number of tasks set by the scaling
+        #the scaling on the number of requests is added by the main stack which owns the target group
+        scalable_target = service.auto_scale_task_count(min_capacity=app_config.min_tasks,
+                                                        max_capacity=app_config.max_tasks)
+        scalable_target.scale_on_cpu_utilization(f"{app_name}CpuScaling",
+                                                 target_utilization_percent=app_config.cpu_target_utilization)
         
+        #create the worker service running the jobs of the application
+        #its container has the same name as the one of the application, so that the pipeline deploys both
+        worker_service = None
+        if job_queue is not None:
+            worker_task_definition = ecs.FargateTaskDefinition(
+                self,
+                f"{app_name}WorkerTaskDefinition",
+                memory_limit_mib=app_config.worker_memory_limit_mib,
+                cpu=app_config.worker_cpu,
+                runtime_platform=ecs.RuntimePlatform(
+                    cpu_architecture=cpu_architecture,
+                    operating_system_family=ecs.OperatingSystemFamily.LINUX,
+                ),
+            )
+            worker_task_definition.add_container(
+                f"{app_name}-Container",
+                image=image,
+                command=["python", "worker.py"],
+                environment=environment,
+                logging=ecs.LogDrivers.aws_logs(stream_prefix=f"{app_name}_WorkerLogs"),
+            )
+
+            worker_service = ecs.FargateService(self, f"{app_name}WorkerService",
+                                                cluster=StreamlitCluster,
+                                                task_definition=worker_task_definition,
+                                                assign_public_ip=False,
+                                                service_name=f"{app_name}-worker",
+                                                capacity_provider_strategies=capacity_provider_strategies,
+                                                )
+
+            job_queue.grant_send_messages(fargate_task_definition.task_role)
+            job_queue.grant_consume_messages(worker_task_definition.task_role)
+
+            #scale the workers on the jobs waiting or running, so that a running job does not scale the service in
+            jobs_metric = cloudwatch.MathExpression(
+                expression="waiting + running",
+                using_metrics={
+                    "waiting": job_queue.metric_approximate_number_of_messages_visible(),
+                    "running": job_queue.metric_approximate_number_of_messages_not_visible(),
+                },
+                period=Duration.minutes(1),
+            )
+            worker_scalable_target = worker_service.auto_scale_task_count(min_capacity=app_config.worker_min_tasks,
+                                                                          max_capacity=app_config.worker_max_tasks)
+            worker_scalable_target.scale_on_metric(f"{app_name}WorkerQueueScaling",
+                                                   metric=jobs_metric,
+                                                   scaling_steps=[
+                                                       {"upper": 0, "change": -1},
+                                                       {"lower": 1, "change": +1},
+                                                       {"lower": 10, "change": +2},
+                                                   ],
+                                                   cooldown=Duration.minutes(1),
+                                                   )
+
         #create an ECR repository for the app
         imagerepository = ecr.Repository(self, f"{app_name}Repository",
                                   repository_name=f"{app_name}-imagerepo",
@@ -257,7 +559,7 @@ class StreamlitApplicationStack(NestedStack):
         #create a code commit repository from the base_app source code
         repository = codecommit.Repository(self, f"{app_name}",
                                            repository_name=f"{app_name}",
-                                           code=codecommit.Code.from_directory("base_app/")
+                                           code=codecommit.Code.from_directory(f"{app_config.source_directory}/")
                                             )
         #create a pipeline to deploy the code commit repository in the service
         pipeline = codepipeline.Pipeline(self, f"{app_name}Pipeline",
@@ -283,7 +585,7 @@ class StreamlitApplicationStack(NestedStack):
                 filename='docker_build_buildspec.yml'),
             environment=codebuild.BuildEnvironment(
                 privileged=True,
-                build_image=codebuild.LinuxBuildImage.STANDARD_5_0
+                build_image=build_image
             ),
             # pass the ecr repo uri into the codebuild project so codebuild knows where to push
             environment_variables={
@@ -296,6 +598,8 @@ class StreamlitApplicationStack(NestedStack):
             },
             description='Pipeline for CodeBuild',
             timeout=Duration.minutes(60),
+            # reuse the docker layers of the previous builds
+            cache=codebuild.Cache.local(codebuild.LocalCacheMode.DOCKER_LAYER),
         )
 
         
@@ -311,7 +615,11 @@ class StreamlitApplicationStack(NestedStack):
 
         # codebuild permissions to interact with ecr
         imagerepository.grant_pull_push(docker_build_project)
+        # to skip the build when the image of the source tree already exists
+        imagerepository.grant(docker_build_project, "ecr:DescribeImages")
         imagerepository.grant_pull_push(service.task_definition.execution_role)
+        if worker_service is not None:
+            imagerepository.grant_pull_push(worker_service.task_definition.execution_role)
 
         pipeline.add_stage(
             stage_name="DockerBuild",
@@ -324,11 +632,74 @@ class StreamlitApplicationStack(NestedStack):
             input=build_output,
         )
 
+        deploy_actions = [deploy_action]
+        if worker_service is not None:
+            deploy_actions.append(codepipeline_actions.EcsDeployAction(
+                action_name="ECS_Deploy_Worker",
+                service=worker_service,
+                input=build_output,
+            ))
+
         pipeline.add_stage(
             stage_name="Deploy",
-            actions=[deploy_action]
+            actions=deploy_actions
+        )
+
+        #monitor the foundation model calls and the script reruns of the application
+        def application_metric(metric_name, statistic):
+            return cloudwatch.Metric(namespace=APPLICATION_METRICS_NAMESPACE,
+                                     metric_name=metric_name,
+                                     dimensions_map={"Application": app_name},
+                                     statistic=statistic,
+                                     period=Duration.minutes(1))
+
+        latency_alarm = cloudwatch.Alarm(self, f"{app_name}LatencyAlarm",
+                                         metric=application_metric("Latency", "p95"),
+                                         threshold=app_config.latency_alarm_threshold_ms,
+                                         evaluation_periods=5,
+                                         datapoints_to_alarm=3,
+                                         treat_missing_data=cloudwatch.TreatMissingData.NOT_BREACHING,
+                                         alarm_description=f"p95 latency of the foundation model calls of {app_name}")
+
+        rerun_alarm = cloudwatch.Alarm(self, f"{app_name}RerunDurationAlarm",
+                                       metric=application_metric("RerunDuration", "p95"),
+                                       threshold=app_config.rerun_alarm_threshold_ms,
+                                       evaluation_periods=5,
+                                       datapoints_to_alarm=3,
+                                       treat_missing_data=cloudwatch.TreatMissingData.NOT_BREACHING,
+                                       alarm_description=f"p95 duration of the script reruns of {app_name}")
+
+        dashboard = cloudwatch.Dashboard(self, f"{app_name}Dashboard",
+                                         dashboard_name=f"StreamlitApplications-{app_name}")
+        dashboard.add_widgets(
+            cloudwatch.GraphWidget(title="Foundation model latency (ms)",
+                                   left=[application_metric("Latency", "p50"),
+                                         application_metric("Latency", "p95"),
+                                         application_metric("TimeToFirstToken", "p95")]),
+            cloudwatch.GraphWidget(title="Script rerun duration (ms)",
+                                   left=[application_metric("RerunDuration", "p50"),
+                                         application_metric("RerunDuration", "p95")]),
+        )
+        dashboard.add_widgets(
+            cloudwatch.GraphWidget(title="Tokens",
+                                   left=[application_metric("InputTokens", "Sum"),
+                                         application_metric("OutputTokens", "Sum")]),
+            cloudwatch.GraphWidget(title="Cache hits and throttles",
+                                   left=[application_metric("CacheHit", "Sum"),
+                                         application_metric("Throttles", "Sum")]),
+            cloudwatch.GraphWidget(title="Service CPU and memory (%)",
+                                   left=[service.metric_cpu_utilization(),
+                                         service.metric_memory_utilization()]),
+        )
+        dashboard.add_widgets(
+            cloudwatch.AlarmWidget(title="Latency alarm", alarm=latency_alarm),
+            cloudwatch.AlarmWidget(title="Rerun duration alarm", alarm=rerun_alarm),
         )
 
         self.service = service
+        self.scalable_target = scalable_target
+        self.job_queue = job_queue
+        self.worker_service = worker_service
         self.app_name = app_name
+        self.app_config = app_config
         self.codecommitrepo = repository
\ No newline at end of file
@@ -0,0 +1,35 @@
+"""
+Microbenchmark of the per-rerun overhead of creating the Llm object of
+base_app/app.py, before (a new Bedrock client on every rerun) and after
+(the Bedrock client shared by the container).
+
+    python -m tests.benchmark.benchmark_llm_client
+"""
+import os
+import sys
+import time
+
+import boto3
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "..", "base_app"))
+from utils.llm import Llm  # noqa: E402
+
+RERUNS = 200
+
+
+def per_rerun_ms(create_llm):
+    start = time.perf_counter()
+    for _ in range(RERUNS):
+        create_llm()
+    return (time.perf_counter() - start) / RERUNS * 1000
+
+
+def main():
+    before = per_rerun_ms(lambda: Llm(bedrock_client=boto3.client('bedrock-runtime', region_name='us-east-1')))
+    after = per_rerun_ms(lambda: Llm())
+    print(f"New client per rerun:    {before:.3f} ms")
+    print(f"Shared client per rerun: {after:.3f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+"""
+Benchmark of the wall time of Llm.summarize against the number of chunks
+of the text, with a fake model answering in a fixed latency, sequentially
+and with several calls in flight.
+
+    python -m tests.benchmark.benchmark_summarize
+    python -m tests.benchmark.benchmark_summarize --latency 0.5 --concurrency 1 4 8
+"""
+import argparse
+import io
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "..", "base_app"))
+from utils.chunking import split_text  # noqa: E402
+from utils.llm import Llm  # noqa: E402
+from utils.metrics import Metrics  # noqa: E402
+from utils.throttling import TokenBucket  # noqa: E402
+
+CHUNK_COUNTS = [1, 4, 16, 64]
+CHUNK_TOKENS = 2000
+
+
+class FakeModel:
+    """
+    Stand-in for the bedrock-runtime client answering each call in a fixed latency
+    """
+
+    def __init__(self, latency):
+        self.latency = latency
+
+    def invoke_model(self, **kwargs):
+        time.sleep(self.latency)
+        completion = "Summary of the part of the text. " * 20
+        return {"body": io.BytesIO(json.dumps({"completion": completion}).encode())}
+
+
+def make_text(chunk_count):
+    """
+    Returns a text split in about chunk_count chunks
+    """
+    sentence_count = 1
+    while True:
+        text = " ".join(f"This is sentence {i} of the transcript." for i in range(sentence_count))
+        if len(split_text(text, max_tokens=CHUNK_TOKENS, overlap_tokens=200)) >= chunk_count:
+            return text
+        sentence_count = int(sentence_count * 1.2) + 1
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--latency", type=float, default=0.2, help="latency of a model call, in seconds")
+    parser.add_argument("--chunks", type=int, nargs="+", default=CHUNK_COUNTS, help="numbers of chunks")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 8], help="calls in flight")
+    args = parser.parse_args()
+
+    print(f"{'chunks':>6} {'calls':>6} " + " ".join(f"{f'{c} in flight':>12}" for c in args.concurrency))
+    for chunk_count in args.chunks:
+        text = make_text(chunk_count)
+        timings = []
+        for max_concurrency in args.concurrency:
+            calls = []
+            llm = Llm(bedrock_client=FakeModel(args.latency), rate_limiter=TokenBucket(rate=1000, capacity=1000),
+                      metrics=Metrics(enabled=False))
+            start = time.perf_counter()
+            llm.summarize(text, chunk_tokens=CHUNK_TOKENS, max_concurrency=max_concurrency,
+                          progress=lambda stage, done, total: calls.append(stage))
+            timings.append(time.perf_counter() - start)
+        actual_chunks = len(split_text(text, max_tokens=CHUNK_TOKENS, overlap_tokens=200))
+        print(f"{actual_chunks:>6} {len(calls):>6} " + " ".join(f"{t:>11.2f}s" for t in timings))
+
+
+if __name__ == "__main__":
+    main()
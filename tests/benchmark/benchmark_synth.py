@@ -0,0 +1,161 @@
+"""
+Synth-time and template-size benchmark of the CDK stacks.
+
+Synthesizes StreamlitApplicationManagerStack with 1, 10, 50 and 100
+applications, each size in its own process, and records the wall time,
+the peak memory, and the resource count and size of the template of the
+main stack and of each nested stack.
+
+    python -m tests.benchmark.benchmark_synth --output bench.json
+    python -m tests.benchmark.benchmark_synth --output bench.json --baseline previous_bench.json
+
+With a baseline (the output of a previous run, e.g. on another commit),
+the run fails when a size is slower, uses more memory or produces bigger
+templates than the baseline by more than the thresholds.
+"""
+import argparse
+import glob
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+APP_COUNTS = [1, 10, 50, 100]
+
+# Allowed growth compared to the baseline, as ratios
+THRESHOLDS = {
+    "synth_seconds": 1.5,
+    "peak_rss_mb": 1.5,
+    "template_bytes": 1.1,
+    "resource_count": 1.1,
+}
+
+ROOT = os.path.join(os.path.dirname(__file__), "..", "..")
+
+
+def _children_peak_rss_mb():
+    """
+    Peak memory of the running child processes, i.e. the node process of jsii.
+    Only available on Linux
+    """
+    peak_kb = 0
+    for children_file in glob.glob(f"/proc/{os.getpid()}/task/*/children"):
+        with open(children_file) as f:
+            for pid in f.read().split():
+                try:
+                    with open(f"/proc/{pid}/status") as status:
+                        for line in status:
+                            if line.startswith("VmHWM:"):
+                                peak_kb += int(line.split()[1])
+                except FileNotFoundError:
+                    pass
+    return peak_kb / 1024
+
+
+def synth(app_count, outdir):
+    """
+    Synthesizes the stacks with app_count applications and returns the measures
+    """
+    import aws_cdk as core
+    from config_file import Config
+    from streamlit_application_manager.streamlit_application_manager_stack import StreamlitApplicationManagerStack
+
+    config = type("BenchmarkConfig", (Config,), {"APPLICATION_LIST": [f"app-{i}" for i in range(app_count)]})
+
+    start = time.perf_counter()
+    app = core.App(outdir=outdir)
+    StreamlitApplicationManagerStack(app, "StreamlitApplicationManagerStack", config=config)
+    app.synth()
+    synth_seconds = time.perf_counter() - start
+
+    stacks = {}
+    for template_file in sorted(glob.glob(os.path.join(outdir, "*.template.json"))):
+        with open(template_file) as f:
+            template = json.load(f)
+        stacks[os.path.basename(template_file)] = {
+            "resource_count": len(template.get("Resources", {})),
+            "template_bytes": os.path.getsize(template_file),
+        }
+
+    return {
+        "app_count": app_count,
+        "synth_seconds": synth_seconds,
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024 + _children_peak_rss_mb(),
+        "resource_count": sum(stack["resource_count"] for stack in stacks.values()),
+        "template_bytes": sum(stack["template_bytes"] for stack in stacks.values()),
+        "stacks": stacks,
+    }
+
+
+def run(app_count):
+    """
+    Runs the synth of app_count applications in a new process, so that each
+    size starts from a cold jsii runtime and its peak memory is its own
+    """
+    with tempfile.TemporaryDirectory() as outdir:
+        completed = subprocess.run(
+            [sys.executable, "-m", "tests.benchmark.benchmark_synth", "--worker", str(app_count), "--outdir", outdir],
+            cwd=ROOT, check=True, capture_output=True, text=True,
+            env={**os.environ, "JSII_SILENCE_WARNING_DEPRECATED_NODE_VERSION": "1"},
+        )
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def compare(results, baseline):
+    """
+    Returns the list of the regressions of the results compared to the baseline
+    """
+    baseline_by_count = {result["app_count"]: result for result in baseline["results"]}
+    regressions = []
+    for result in results:
+        previous = baseline_by_count.get(result["app_count"])
+        if previous is None:
+            continue
+        for measure, threshold in THRESHOLDS.items():
+            if previous[measure] and result[measure] > previous[measure] * threshold:
+                regressions.append(
+                    f"{result['app_count']} apps: {measure} {result[measure]:.2f} > "
+                    f"{threshold} x {previous[measure]:.2f}"
+                )
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--output", default="bench_output.json", help="file to write the results to")
+    parser.add_argument("--baseline", help="results of a previous run to compare with")
+    parser.add_argument("--apps", type=int, nargs="+", default=APP_COUNTS, help="numbers of applications to synthesize")
+    parser.add_argument("--worker", type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--outdir", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker is not None:
+        print(json.dumps(synth(args.worker, args.outdir)))
+        return 0
+
+    results = []
+    for app_count in args.apps:
+        result = run(app_count)
+        print(f"{app_count:>4} apps: {result['synth_seconds']:6.1f}s {result['peak_rss_mb']:7.0f}MB "
+              f"{result['resource_count']:6} resources {result['template_bytes']:9} bytes")
+        results.append(result)
+
+    with open(args.output, "w") as f:
+        json.dump({"results": results}, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f))
+        for regression in regressions:
+            print(f"Regression: {regression}")
+        if regressions:
+            return 1
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,163 @@
+"""
+Fake of the AWS APIs called by base_app, for the load tests: Bedrock
+runtime (InvokeModel and InvokeModelWithResponseStream) and Secrets Manager
+(GetSecretValue). Every call waits for a configurable latency, and the
+streamed completions are sent token by token.
+
+Cognito is only called by base_app to log in with a password: the load test
+sessions present access tokens signed by the load test instead, verified by
+the application with the keys of the COGNITO_JWKS environment variable.
+
+Standard library only, so that it runs in a bare python image:
+
+    python fake_aws.py --port 4566 --ttft 0.5 --token-delay 0.02 --tokens 100
+"""
+import argparse
+import base64
+import binascii
+import json
+import os
+import re
+import struct
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Cognito parameters of the secret, the access tokens of the load test are issued for this pool
+POOL_ID = "us-east-1_LoadTest"
+APP_CLIENT_ID = "loadtestclient"
+APP_CLIENT_SECRET = "loadtestsecret"
+
+
+def encode_event(headers, payload):
+    """
+    Encode a message of the application/vnd.amazon.eventstream format used by
+    the streaming APIs: prelude, headers, payload and CRC32 checksums
+    """
+    encoded_headers = b""
+    for name, value in headers.items():
+        name, value = name.encode("utf-8"), value.encode("utf-8")
+        # 7 is the type of string headers
+        encoded_headers += struct.pack(">B", len(name)) + name + struct.pack(">BH", 7, len(value)) + value
+
+    total_length = 12 + len(encoded_headers) + len(payload) + 4
+    prelude = struct.pack(">II", total_length, len(encoded_headers))
+    message = prelude + struct.pack(">I", binascii.crc32(prelude)) + encoded_headers + payload
+    return message + struct.pack(">I", binascii.crc32(message))
+
+
+def encode_chunk(payload):
+    """
+    Encode a chunk event of InvokeModelWithResponseStream
+    """
+    return encode_event(
+        {":event-type": "chunk", ":content-type": "application/json", ":message-type": "event"},
+        json.dumps({"bytes": base64.b64encode(json.dumps(payload).encode("utf-8")).decode("ascii")}).encode("utf-8"),
+    )
+
+
+class FakeAwsHandler(BaseHTTPRequestHandler):
+
+    protocol_version = "HTTP/1.1"
+
+    # Set by make_server
+    options = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status, body, content_type="application/json", headers=None):
+        body = body if isinstance(body, bytes) else json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("x-amzn-RequestId", "loadtest")
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _write_chunk(self, data):
+        self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        target = self.headers.get("X-Amz-Target", "")
+
+        if target == "secretsmanager.GetSecretValue":
+            time.sleep(self.options.secrets_latency)
+            secret_id = json.loads(body)["SecretId"]
+            return self._send(200, {
+                "ARN": f"arn:aws:secretsmanager:us-east-1:000000000000:secret:{secret_id}",
+                "Name": secret_id,
+                "VersionId": "loadtest",
+                "VersionStages": ["AWSCURRENT"],
+                "SecretString": json.dumps({"pool_id": POOL_ID, "app_client_id": APP_CLIENT_ID,
+                                            "app_client_secret": APP_CLIENT_SECRET}),
+            }, content_type="application/x-amz-json-1.1")
+
+        match = re.fullmatch(r"/model/([^/]+)/(invoke|invoke-with-response-stream)", self.path)
+        if match is None:
+            return self._send(400, {"__type": "UnknownOperationException", "message": f"{target or self.path}"})
+
+        prompt = json.loads(body).get("prompt", "")
+        input_tokens = len(prompt) // 4
+        tokens = [f" token{i}" for i in range(self.options.tokens)]
+
+        if match.group(2) == "invoke":
+            time.sleep(self.options.ttft + self.options.token_delay * len(tokens))
+            return self._send(200, {"completion": "".join(tokens), "stop_reason": "stop_sequence"}, headers={
+                "x-amzn-bedrock-input-token-count": str(input_tokens),
+                "x-amzn-bedrock-output-token-count": str(len(tokens)),
+            })
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/vnd.amazon.eventstream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.send_header("x-amzn-RequestId", "loadtest")
+        self.end_headers()
+        time.sleep(self.options.ttft)
+        for i, token in enumerate(tokens):
+            payload = {"completion": token, "stop_reason": None}
+            if i == len(tokens) - 1:
+                payload["stop_reason"] = "stop_sequence"
+                payload["amazon-bedrock-invocationMetrics"] = {"inputTokenCount": input_tokens,
+                                                               "outputTokenCount": len(tokens)}
+            self._write_chunk(encode_chunk(payload))
+            time.sleep(self.options.token_delay)
+        self._write_chunk(b"")
+
+    def do_GET(self):
+        # Health check of the docker-compose service
+        self._send(200, {"status": "ok"})
+
+
+def make_server(port, ttft=0.5, token_delay=0.02, tokens=100, secrets_latency=0.05):
+    options = argparse.Namespace(ttft=ttft, token_delay=token_delay, tokens=tokens, secrets_latency=secrets_latency)
+    handler = type("Handler", (FakeAwsHandler,), {"options": options})
+    server = ThreadingHTTPServer(("0.0.0.0", port), handler)
+    server.daemon_threads = True
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=int(os.environ.get("FAKE_AWS_PORT", 4566)))
+    parser.add_argument("--ttft", type=float, default=float(os.environ.get("FAKE_BEDROCK_TTFT", 0.5)),
+                        help="seconds before the first token of a completion")
+    parser.add_argument("--token-delay", type=float, default=float(os.environ.get("FAKE_BEDROCK_TOKEN_DELAY", 0.02)),
+                        help="seconds between two tokens of a completion")
+    parser.add_argument("--tokens", type=int, default=int(os.environ.get("FAKE_BEDROCK_TOKENS", 100)),
+                        help="number of tokens of a completion")
+    parser.add_argument("--secrets-latency", type=float,
+                        default=float(os.environ.get("FAKE_SECRETS_LATENCY", 0.05)),
+                        help="seconds to get a secret")
+    args = parser.parse_args()
+
+    server = make_server(args.port, args.ttft, args.token_delay, args.tokens, args.secrets_latency)
+    print(f"Fake AWS APIs listening on port {args.port}", flush=True)
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,449 @@
+"""
+Load test of base_app: how many concurrent Streamlit sessions one task of a
+given size serves before the rerun latency degrades.
+
+The application runs through base_app/docker-compose.yml, with the CPU and
+memory limits of the task size, next to fakes of Bedrock and Secrets Manager
+injecting latency (see fake_aws.py). For each number of sessions, the
+sessions open a websocket each, log in with a signed access token, then
+drive reruns of the script with a new input text every time. The run
+reports the p50 and p95 rerun latency, the CPU and the memory per session,
+and recommends the task count of the per-app ApplicationConfig.
+
+    python -m tests.loadtest.run_loadtest --sessions 1 5 10 20 40 --output loadtest.json
+
+With --url, the load test targets an application already running instead,
+e.g. started with `streamlit run app.py` next to `python fake_aws.py`, and
+--pid samples the CPU and memory of its process. The application must be
+started with the keys of the load test in COGNITO_JWKS, and the
+AWS_ENDPOINT_URL_* variables of docker-compose.loadtest.yml:
+
+    export COGNITO_JWKS=$(python -m tests.loadtest.run_loadtest --key-file loadtest.pem --print-jwks)
+    python -m tests.loadtest.run_loadtest --key-file loadtest.pem --url http://localhost:8501 --pid 1234
+"""
+import argparse
+import asyncio
+import base64
+import json
+import math
+import os
+import statistics
+import subprocess
+import sys
+import threading
+import time
+import urllib.request
+import uuid
+
+import jwt
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from tornado.websocket import websocket_connect
+from streamlit.proto.BackMsg_pb2 import BackMsg
+from streamlit.proto.ForwardMsg_pb2 import ForwardMsg
+from streamlit.proto.WidgetStates_pb2 import WidgetState
+
+from tests.loadtest.fake_aws import POOL_ID
+
+ROOT = os.path.join(os.path.dirname(__file__), "..", "..")
+COMPOSE_FILES = [os.path.join(ROOT, "base_app", "docker-compose.yml"),
+                 os.path.join(os.path.dirname(__file__), "docker-compose.loadtest.yml")]
+
+# Name of the custom component of the cookies of the Cognito authenticator
+COOKIE_MANAGER_COMPONENT = "cookie_manager"
+
+# Margins kept on the CPU and the memory of a task at the recommended number of sessions
+MAX_CPU_UTILIZATION = 0.8
+MAX_MEMORY_UTILIZATION = 0.8
+
+
+def _b64(number):
+    return base64.urlsafe_b64encode(number.to_bytes((number.bit_length() + 7) // 8, "big")).rstrip(b"=").decode()
+
+
+class TokenIssuer:
+    """
+    Signs the access tokens of the load test sessions, verified by the
+    application with the JWKS given in its COGNITO_JWKS environment variable
+    """
+
+    KEY_ID = "loadtest"
+
+    def __init__(self, key_file=None):
+        # The key is kept in key_file, when given, so that an application
+        # started beforehand can be given the JWKS
+        if key_file and os.path.exists(key_file):
+            with open(key_file, "rb") as f:
+                self.private_key = serialization.load_pem_private_key(f.read(), password=None)
+        else:
+            self.private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+            if key_file:
+                with open(key_file, "wb") as f:
+                    f.write(self.private_key.private_bytes(serialization.Encoding.PEM,
+                                                           serialization.PrivateFormat.PKCS8,
+                                                           serialization.NoEncryption()))
+        public_numbers = self.private_key.public_key().public_numbers()
+        self.jwks = {"keys": [{"kty": "RSA", "alg": "RS256", "use": "sig", "kid": self.KEY_ID,
+                               "n": _b64(public_numbers.n), "e": _b64(public_numbers.e)}]}
+
+    def access_token(self, username):
+        now = int(time.time())
+        return jwt.encode({
+            "sub": username,
+            "username": username,
+            "token_use": "access",
+            "iss": f"https://cognito-idp.{POOL_ID.split('_')[0]}.amazonaws.com/{POOL_ID}",
+            "iat": now,
+            "exp": now + 4 * 3600,
+        }, self.private_key, algorithm="RS256", headers={"kid": self.KEY_ID})
+
+
+class StreamlitSession:
+    """
+    Streamlit session driven over the websocket of the application, as a
+    browser does: each rerun sends the state of the widgets and waits for
+    the end of the script
+    """
+
+    def __init__(self, url, timeout=120.):
+        self.url = url.replace("http", "ws", 1).rstrip("/") + "/_stcore/stream"
+        self.timeout = timeout
+        self.widget_states = {}
+        self.elements = []
+        self._ws = None
+
+    async def connect(self):
+        self._ws = await websocket_connect(self.url, max_message_size=256 * 1024 * 1024)
+
+    def close(self):
+        if self._ws is not None:
+            self._ws.close()
+
+    async def rerun(self):
+        """
+        Rerun the script with the current widget states and returns its
+        duration in seconds
+        """
+        back_msg = BackMsg()
+        back_msg.rerun_script.query_string = ""
+        back_msg.rerun_script.page_script_hash = ""
+        back_msg.rerun_script.widget_states.widgets.extend(self.widget_states.values())
+
+        start = time.perf_counter()
+        await self._ws.write_message(back_msg.SerializeToString(), binary=True)
+        self.elements = []
+        while True:
+            message = await asyncio.wait_for(self._ws.read_message(), self.timeout)
+            if message is None:
+                raise ConnectionError("The websocket of the session was closed")
+            forward_msg = ForwardMsg()
+            forward_msg.ParseFromString(message)
+            kind = forward_msg.WhichOneof("type")
+            if kind == "delta" and forward_msg.delta.WhichOneof("type") == "new_element":
+                self.elements.append(forward_msg.delta.new_element)
+            elif kind == "script_finished":
+                if forward_msg.script_finished == ForwardMsg.FINISHED_WITH_COMPILE_ERROR:
+                    raise RuntimeError("The script of the application failed to compile")
+                if forward_msg.script_finished == ForwardMsg.FINISHED_SUCCESSFULLY:
+                    return time.perf_counter() - start
+
+    def find_widget(self, element_type, predicate=lambda widget: True):
+        """
+        Returns the id of the first widget of a type rendered by the last rerun
+        """
+        for element in self.elements:
+            if element.WhichOneof("type") == element_type and predicate(getattr(element, element_type)):
+                return getattr(element, element_type).id
+        raise LookupError(f"No {element_type} widget in the page")
+
+    def set_widget(self, widget_id, **value):
+        self.widget_states[widget_id] = WidgetState(id=widget_id, **value)
+
+    async def login(self, access_token):
+        """
+        Log in by answering the cookie manager component of the authenticator
+        with the access token, as the browser does with its cookies
+        """
+        await self.rerun()
+        cookie_manager_id = self.find_widget(
+            "component_instance", lambda widget: widget.component_name.endswith(COOKIE_MANAGER_COMPONENT))
+        self.set_widget(cookie_manager_id, json_value=json.dumps({"access_token": access_token}))
+        await self.rerun()
+
+
+async def run_session(url, index, token, reruns, think_time, latencies, errors):
+    session = StreamlitSession(url)
+    try:
+        await session.connect()
+        await session.login(token)
+        input_id = session.find_widget("text_input", lambda widget: widget.label == "Input Sentence")
+        session_id = uuid.uuid4().hex
+        for rerun in range(reruns):
+            # A new input text on every rerun, so that every rerun calls the model instead of hitting the cache
+            session.set_widget(input_id, string_value=f"Session {index} ({session_id}), rerun {rerun}: say hello.")
+            latencies.append(await session.rerun())
+            await asyncio.sleep(think_time)
+    except Exception as e:
+        errors.append(repr(e))
+    finally:
+        session.close()
+
+
+class ResourceSampler:
+    """
+    Samples, every second in a background thread, the CPU (in percent of one
+    vCPU) and the memory (in MB) of the container of the application with
+    docker stats, or of a local process with /proc
+    """
+
+    def __init__(self, container=None, pid=None, interval=1.):
+        self.container = container
+        self.pid = pid
+        self.interval = interval
+        self.samples = []
+        self._stop = threading.Event()
+        self._thread = None
+
+    @staticmethod
+    def _parse_size_mb(size):
+        units = {"B": 1 / 1024 ** 2, "KiB": 1 / 1024, "kB": 1 / 1024, "MiB": 1, "MB": 1, "GiB": 1024, "GB": 1024}
+        for unit in sorted(units, key=len, reverse=True):
+            if size.endswith(unit):
+                return float(size[:-len(unit)]) * units[unit]
+        return float(size)
+
+    def _docker_sample(self):
+        stats = json.loads(subprocess.run(
+            ["docker", "stats", "--no-stream", "--format", "{{json .}}", self.container],
+            check=True, capture_output=True, text=True).stdout)
+        return float(stats["CPUPerc"].rstrip("%")), self._parse_size_mb(stats["MemUsage"].split("/")[0].strip())
+
+    def _proc_cpu_seconds(self):
+        with open(f"/proc/{self.pid}/stat") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+        return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+    def _proc_memory_mb(self):
+        with open(f"/proc/{self.pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+        return 0.
+
+    def _run(self):
+        previous = (time.monotonic(), self._proc_cpu_seconds()) if self.pid else None
+        while not self._stop.wait(self.interval):
+            try:
+                if self.container:
+                    self.samples.append(self._docker_sample())
+                elif self.pid:
+                    now, cpu_seconds = time.monotonic(), self._proc_cpu_seconds()
+                    cpu_percent = (cpu_seconds - previous[1]) / (now - previous[0]) * 100
+                    previous = (now, cpu_seconds)
+                    self.samples.append((cpu_percent, self._proc_memory_mb()))
+            except (OSError, subprocess.CalledProcessError, ValueError) as e:
+                print(f"Failed to sample the resources: {e}")
+
+    def __enter__(self):
+        self.samples = []
+        self._stop.clear()
+        if self.container or self.pid:
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+
+def percentile(values, ratio):
+    """
+    Returns a percentile of values, by nearest rank
+    """
+    values = sorted(values)
+    return values[max(0, math.ceil(ratio * len(values)) - 1)]
+
+
+async def run_stage(url, issuer, sessions, reruns, think_time):
+    latencies, errors = [], []
+    await asyncio.gather(*[
+        run_session(url, index, issuer.access_token(f"loadtest-{index}"), reruns, think_time, latencies, errors)
+        for index in range(sessions)
+    ])
+    return latencies, errors
+
+
+def run_stages(url, issuer, session_counts, reruns, think_time, sampler):
+    """
+    Runs the load test with each number of sessions and returns the measures
+    of each stage
+    """
+    stages = []
+    for sessions in session_counts:
+        with sampler:
+            start = time.perf_counter()
+            latencies, errors = asyncio.run(run_stage(url, issuer, sessions, reruns, think_time))
+            duration = time.perf_counter() - start
+
+        stage = {
+            "sessions": sessions,
+            "reruns": len(latencies),
+            "errors": len(errors),
+            "duration_s": duration,
+            "p50_ms": percentile(latencies, 0.5) * 1000 if latencies else None,
+            "p95_ms": percentile(latencies, 0.95) * 1000 if latencies else None,
+            "cpu_percent": statistics.mean(cpu for cpu, _ in sampler.samples) if sampler.samples else None,
+            "peak_memory_mb": max(memory for _, memory in sampler.samples) if sampler.samples else None,
+        }
+        stages.append(stage)
+        print(f"{sessions:>4} sessions: p50 {stage['p50_ms'] or 0:8.0f}ms  p95 {stage['p95_ms'] or 0:8.0f}ms  "
+              f"cpu {stage['cpu_percent'] or 0:5.1f}%  memory {stage['peak_memory_mb'] or 0:7.1f}MB  "
+              f"errors {stage['errors']}")
+        for error in sorted(set(errors))[:3]:
+            print(f"      {error}")
+    return stages
+
+
+def recommend(stages, task_cpu, task_memory_mib, p95_target_ms, expected_sessions, app_name="video-summarisation"):
+    """
+    Returns the number of sessions a task of the given size serves within
+    the p95 rerun latency target and the CPU and memory margins, the memory
+    per session, and the ApplicationConfig sized for the expected number of
+    concurrent sessions of the application
+    """
+    measured = [stage for stage in stages if stage["peak_memory_mb"] is not None]
+    memory_per_session_mb = None
+    base_memory_mb = None
+    if len(measured) >= 2:
+        # Least squares fit of the peak memory on the number of sessions
+        mean_sessions = statistics.mean(stage["sessions"] for stage in measured)
+        mean_memory = statistics.mean(stage["peak_memory_mb"] for stage in measured)
+        variance = sum((stage["sessions"] - mean_sessions) ** 2 for stage in measured)
+        if variance:
+            memory_per_session_mb = sum((stage["sessions"] - mean_sessions) * (stage["peak_memory_mb"] - mean_memory)
+                                        for stage in measured) / variance
+            base_memory_mb = mean_memory - memory_per_session_mb * mean_sessions
+
+    sessions_per_task = 0
+    limited_by = None
+    for stage in sorted(stages, key=lambda stage: stage["sessions"]):
+        if stage["errors"] or stage["p95_ms"] is None:
+            limited_by = "errors"
+        elif stage["p95_ms"] > p95_target_ms:
+            limited_by = "latency"
+        elif stage["cpu_percent"] is not None and stage["cpu_percent"] > task_cpu / 1024 * 100 * MAX_CPU_UTILIZATION:
+            limited_by = "cpu"
+        elif stage["peak_memory_mb"] is not None and stage["peak_memory_mb"] > task_memory_mib * MAX_MEMORY_UTILIZATION:
+            limited_by = "memory"
+        if limited_by:
+            break
+        sessions_per_task = stage["sessions"]
+
+    recommendation = {
+        "sessions_per_task": sessions_per_task,
+        "limited_by": limited_by,
+        "memory_per_session_mb": memory_per_session_mb,
+        "base_memory_mb": base_memory_mb,
+    }
+    if sessions_per_task:
+        recommendation["application_config"] = {
+            "name": app_name,
+            "cpu": task_cpu,
+            "memory_limit_mib": task_memory_mib,
+            "min_tasks": 1,
+            "max_tasks": max(1, math.ceil(expected_sessions / sessions_per_task)),
+        }
+    return recommendation
+
+
+def wait_until_healthy(url, timeout=180):
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            with urllib.request.urlopen(url.rstrip("/") + "/_stcore/health", timeout=5) as response:
+                if response.status == 200:
+                    return
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+        time.sleep(1)
+
+
+def compose(*command, env=None, capture=False):
+    files = [option for compose_file in COMPOSE_FILES for option in ("-f", compose_file)]
+    return subprocess.run(["docker", "compose", *files, *command], check=True, env=env,
+                          capture_output=capture, text=True).stdout
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sessions", type=int, nargs="+", default=[1, 5, 10, 20, 40],
+                        help="numbers of concurrent sessions of the stages")
+    parser.add_argument("--reruns", type=int, default=10, help="reruns per session")
+    parser.add_argument("--think-time", type=float, default=1., help="seconds between two reruns of a session")
+    parser.add_argument("--cpu", type=int, default=256, help="task CPU units, as in ApplicationConfig")
+    parser.add_argument("--memory", type=int, default=512, help="task memory in MiB, as in ApplicationConfig")
+    parser.add_argument("--p95-target-ms", type=float, default=5000, help="p95 rerun latency target")
+    parser.add_argument("--expected-sessions", type=int, default=100,
+                        help="peak concurrent sessions of the application, to size max_tasks")
+    parser.add_argument("--app-name", default="video-summarisation")
+    parser.add_argument("--ttft", type=float, default=0.5, help="fake Bedrock time to first token, in seconds")
+    parser.add_argument("--token-delay", type=float, default=0.02, help="fake Bedrock seconds per token")
+    parser.add_argument("--url", help="URL of an application already running, instead of docker-compose")
+    parser.add_argument("--pid", type=int, help="with --url, process of the application to sample")
+    parser.add_argument("--key-file", help="file of the key signing the access tokens, created if missing")
+    parser.add_argument("--print-jwks", action="store_true", help="print the JWKS of the key and exit")
+    parser.add_argument("--keep", action="store_true", help="leave the docker-compose services running")
+    parser.add_argument("--output", default="loadtest_output.json", help="file to write the results to")
+    args = parser.parse_args()
+
+    issuer = TokenIssuer(args.key_file)
+    if args.print_jwks:
+        print(json.dumps(issuer.jwks))
+        return 0
+
+    url = args.url
+    sampler = ResourceSampler(pid=args.pid)
+    if url is None:
+        url = "http://localhost:8080"
+        env = {
+            **os.environ,
+            "COGNITO_JWKS": json.dumps(issuer.jwks),
+            "TASK_CPUS": str(args.cpu / 1024),
+            "TASK_MEMORY": f"{args.memory}m",
+            "FAKE_BEDROCK_TTFT": str(args.ttft),
+            "FAKE_BEDROCK_TOKEN_DELAY": str(args.token_delay),
+        }
+        compose("up", "--detach", "--build", env=env)
+        sampler = ResourceSampler(container=compose("ps", "--quiet", "streamlit", env=env, capture=True).strip())
+
+    try:
+        wait_until_healthy(url)
+        stages = run_stages(url, issuer, args.sessions, args.reruns, args.think_time, sampler)
+    finally:
+        if args.url is None and not args.keep:
+            compose("down")
+
+    recommendation = recommend(stages, args.cpu, args.memory, args.p95_target_ms, args.expected_sessions,
+                               args.app_name)
+    with open(args.output, "w") as f:
+        json.dump({"stages": stages, "recommendation": recommendation}, f, indent=2)
+
+    print(f"\nA task of cpu={args.cpu} memory_limit_mib={args.memory} serves "
+          f"{recommendation['sessions_per_task']} concurrent sessions, limited by "
+          f"{recommendation['limited_by'] or 'the largest stage'}")
+    if recommendation["memory_per_session_mb"] is not None:
+        print(f"Memory per session: {recommendation['memory_per_session_mb']:.1f}MB, "
+              f"base memory: {recommendation['base_memory_mb']:.1f}MB")
+    if "application_config" in recommendation:
+        config = ", ".join(f"{name}={value!r}" for name, value in recommendation["application_config"].items())
+        print(f"For {args.expected_sessions} concurrent sessions, in config_file.py:\n    ApplicationConfig({config})")
+    else:
+        print("No stage met the targets, try a larger task size with --cpu and --memory")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
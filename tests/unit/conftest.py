@@ -0,0 +1,5 @@
+import os
+import sys
+
+# Make the modules of the Streamlit base application importable by the tests
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "..", "base_app"))
@@ -0,0 +1,95 @@
+import json
+import time
+
+import boto3
+from botocore.stub import Stubber
+
+from utils import auth
+from utils.auth import Auth, SecretCache
+
+SECRET_ID = "StreamlitApplicationsParamCognitoSecret"
+
+
+class FakeClock:
+
+    def __init__(self):
+        self.now = 0.
+
+    def __call__(self):
+        return self.now
+
+
+def secret_response(version_id, app_client_id="client"):
+    return {
+        "ARN": f"arn:aws:secretsmanager:us-east-1:123456789012:secret:{SECRET_ID}-AbCdEf",
+        "Name": SECRET_ID,
+        "VersionId": version_id,
+        "SecretString": json.dumps({
+            "pool_id": "us-east-1_abcdefghi",
+            "app_client_id": app_client_id,
+            "app_client_secret": "secret",
+        }),
+    }
+
+
+def make_cache(ttl=300):
+    client = boto3.client("secretsmanager", region_name="us-east-1")
+    clock = FakeClock()
+    return SecretCache(client=client, ttl=ttl, clock=clock), Stubber(client), clock
+
+
+def test_secret_is_fetched_once_per_ttl():
+    cache, stubber, clock = make_cache(ttl=300)
+    stubber.add_response("get_secret_value", secret_response("v1" * 16), {"SecretId": SECRET_ID})
+    stubber.add_response("get_secret_value", secret_response("v2" * 16), {"SecretId": SECRET_ID})
+
+    with stubber:
+        # Many reruns within the refresh window make a single call
+        for _ in range(100):
+            assert cache.get_secret(SECRET_ID)["VersionId"] == "v1" * 16
+            clock.now += 2
+
+        clock.now = 300
+        assert cache.get_secret(SECRET_ID)["VersionId"] == "v2" * 16
+        stubber.assert_no_pending_responses()
+
+
+def test_secret_is_refreshed_in_background():
+    cache, stubber, clock = make_cache(ttl=300)
+    stubber.add_response("get_secret_value", secret_response("v1" * 16), {"SecretId": SECRET_ID})
+    stubber.add_response("get_secret_value", secret_response("v2" * 16), {"SecretId": SECRET_ID})
+
+    with stubber:
+        cache.get_secret(SECRET_ID)
+
+        # Stale secrets are still served while they are refreshed
+        clock.now = 250
+        assert cache.get_secret(SECRET_ID)["VersionId"] == "v1" * 16
+
+        deadline = time.monotonic() + 5
+        while cache.get_secret(SECRET_ID)["VersionId"] != "v2" * 16 and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+        assert cache.get_secret(SECRET_ID)["VersionId"] == "v2" * 16
+        stubber.assert_no_pending_responses()
+
+
+def test_authenticator_picks_up_new_secret_version(monkeypatch):
+    cache, stubber, clock = make_cache(ttl=300)
+    stubber.add_response("get_secret_value", secret_response("v1" * 16, "client-1"), {"SecretId": SECRET_ID})
+    stubber.add_response("get_secret_value", secret_response("v2" * 16, "client-2"), {"SecretId": SECRET_ID})
+
+    authenticators = []
+    monkeypatch.setattr(auth, "CognitoAuthenticator", lambda **kwargs: authenticators.append(kwargs) or kwargs)
+    monkeypatch.setattr(Auth, "secret_cache", cache)
+
+    with stubber:
+        for _ in range(10):
+            Auth.get_authenticator(SECRET_ID)
+        clock.now = 300
+        Auth.get_authenticator(SECRET_ID)
+        stubber.assert_no_pending_responses()
+
+    assert [a["app_client_id"] for a in authenticators] == ["client-1"] * 10 + ["client-2"]
+    # The Cognito client is shared by all the authenticators
+    assert len({id(a["boto_client"]) for a in authenticators}) == 1
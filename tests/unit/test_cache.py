@@ -0,0 +1,106 @@
+import io
+import json
+
+import boto3
+from moto import mock_aws
+
+from utils.cache import ResponseCache
+from utils.llm import Llm
+
+
+class FakeClock:
+
+    def __init__(self):
+        self.now = 1000.
+
+    def __call__(self):
+        return self.now
+
+
+class FakeBedrockClient:
+    """Stand-in for the bedrock-runtime client counting the calls"""
+
+    def __init__(self):
+        self.calls = 0
+
+    def invoke_model(self, **kwargs):
+        self.calls += 1
+        return {"body": io.BytesIO(json.dumps({"completion": "Hola", "stop_reason": "stop_sequence"}).encode())}
+
+    def invoke_model_with_response_stream(self, **kwargs):
+        self.calls += 1
+        return {"body": iter([
+            {"chunk": {"bytes": json.dumps({"completion": "Ho"}).encode()}},
+            {"chunk": {"bytes": json.dumps({"completion": "la", "stop_reason": "stop_sequence"}).encode()}},
+        ])}
+
+
+def test_key_depends_on_model_and_parameters():
+    body = {"prompt": "Hello", "temperature": 0.}
+
+    assert ResponseCache.key("model", body) == ResponseCache.key("model", json.dumps(body))
+    assert ResponseCache.key("model", body) != ResponseCache.key("other-model", body)
+    assert ResponseCache.key("model", body) != ResponseCache.key("model", {**body, "temperature": 1.})
+
+
+def test_memory_tier_is_bounded_lru_with_ttl():
+    clock = FakeClock()
+    cache = ResponseCache(max_entries=2, ttl=60, clock=clock)
+
+    cache.put("a", {"completion": "A"})
+    cache.put("b", {"completion": "B"})
+    assert cache.get("a") == {"completion": "A"}
+    cache.put("c", {"completion": "C"})
+
+    # "b" was the least recently used entry
+    assert cache.get("b") is None
+    assert cache.get("a") == {"completion": "A"}
+
+    clock.now += 60
+    assert cache.get("c") is None
+    assert cache.stats() == {"memory_hits": 2, "s3_hits": 0, "misses": 2, "entries": 1}
+
+
+@mock_aws
+def test_s3_tier_is_shared_under_app_prefix():
+    s3 = boto3.client("s3", region_name="us-east-1")
+    s3.create_bucket(Bucket="applications-bucket")
+    clock = FakeClock()
+
+    writer = ResponseCache(bucket_name="applications-bucket", prefix="my-app/", s3_client=s3, clock=clock)
+    writer.put("key", {"completion": "A"})
+    assert s3.list_objects_v2(Bucket="applications-bucket")["Contents"][0]["Key"] == "my-app/llm-cache/key.json"
+
+    # Another task of the application finds the response in S3
+    reader = ResponseCache(bucket_name="applications-bucket", prefix="my-app/", s3_client=s3, clock=clock, s3_ttl=60)
+    assert reader.get("key") == {"completion": "A"}
+    assert reader.get("key") == {"completion": "A"}
+    assert reader.stats()["s3_hits"] == 1
+    assert reader.stats()["memory_hits"] == 1
+
+    expired = ResponseCache(bucket_name="applications-bucket", prefix="my-app/", s3_client=s3, clock=clock, s3_ttl=60)
+    clock.now += 60
+    assert expired.get("key") is None
+    assert expired.get("missing") is None
+
+
+def test_llm_invoke_uses_cache_unless_bypassed():
+    client = FakeBedrockClient()
+    llm = Llm(bedrock_client=client, cache=ResponseCache())
+
+    for _ in range(3):
+        assert json.loads(llm.invoke("Say Hello World!")["body"].read())["completion"] == "Hola"
+    assert client.calls == 1
+
+    llm.invoke("Say Hello World!", use_cache=False)
+    assert client.calls == 2
+
+
+def test_llm_stream_caches_complete_responses():
+    client = FakeBedrockClient()
+    llm = Llm(bedrock_client=client, cache=ResponseCache())
+
+    assert list(llm.stream("Say Hello World!")) == ["Ho", "la"]
+    assert list(llm.stream("Say Hello World!")) == ["Hola"]
+    assert client.calls == 1
+    assert json.loads(llm.invoke("Say Hello World!")["body"].read()) == {"completion": "Hola", "stop_reason": "stop_sequence"}
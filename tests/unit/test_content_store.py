@@ -0,0 +1,125 @@
+import mmap
+import os
+
+import boto3
+import pytest
+from moto import mock_aws
+
+from utils.content_store import ContentStore
+
+BUCKET = "applications-bucket"
+PREFIX = "video-summarisation/"
+
+
+class CountingS3Client:
+    """Wraps the s3 client to count the GETs and their ranges"""
+
+    def __init__(self, client):
+        self.client = client
+        self.ranges = []
+
+    def get_object(self, **kwargs):
+        self.ranges.append(kwargs.get("Range"))
+        return self.client.get_object(**kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self.client, name)
+
+
+@pytest.fixture
+def s3():
+    with mock_aws():
+        client = boto3.client("s3", region_name="us-east-1")
+        client.create_bucket(Bucket=BUCKET)
+        yield CountingS3Client(client)
+
+
+def test_unchanged_object_is_validated_not_downloaded(s3, tmp_path):
+    s3.put_object(Bucket=BUCKET, Key=PREFIX + "data.txt", Body=b"hello")
+    store = ContentStore(bucket_name=BUCKET, prefix=PREFIX, cache_dir=str(tmp_path), s3_client=s3)
+
+    assert store.read("data.txt") == b"hello"
+    assert store.read("data.txt") == b"hello"
+
+    stats = store.stats()
+    assert (stats["hits"], stats["misses"]) == (1, 1)
+    assert stats["hit_rate"] == 0.5
+    assert stats["bytes_saved"] == 5
+    assert stats["bytes_downloaded"] == 5
+
+
+def test_changed_object_is_downloaded_again(s3, tmp_path):
+    s3.put_object(Bucket=BUCKET, Key=PREFIX + "data.txt", Body=b"hello")
+    store = ContentStore(bucket_name=BUCKET, prefix=PREFIX, cache_dir=str(tmp_path), s3_client=s3)
+    store.read("data.txt")
+
+    s3.put_object(Bucket=BUCKET, Key=PREFIX + "data.txt", Body=b"hello world")
+
+    assert store.read("data.txt") == b"hello world"
+    assert store.stats()["misses"] == 2
+    assert store.stats()["cached_bytes"] == 11
+
+
+def test_large_object_is_downloaded_in_ranges_and_memory_mapped(s3, tmp_path):
+    content = bytes(range(256)) * 4096
+    s3.put_object(Bucket=BUCKET, Key=PREFIX + "video.mp4", Body=content)
+    store = ContentStore(bucket_name=BUCKET, prefix=PREFIX, cache_dir=str(tmp_path), s3_client=s3,
+                         part_size=256 * 1024, mmap_threshold=512 * 1024)
+
+    data = store.read("video.mp4")
+
+    assert isinstance(data, mmap.mmap)
+    assert data[:] == content
+    data.close()
+    assert sorted(r for r in s3.ranges if r) == [f"bytes={start}-{start + 256 * 1024 - 1}"
+                                                 for start in range(0, len(content), 256 * 1024)]
+
+
+def test_least_recently_used_objects_are_evicted(s3, tmp_path):
+    for name in ["a", "b", "c"]:
+        s3.put_object(Bucket=BUCKET, Key=PREFIX + name, Body=b"x" * 100)
+    store = ContentStore(bucket_name=BUCKET, prefix=PREFIX, cache_dir=str(tmp_path), s3_client=s3, max_bytes=250)
+
+    store.get_path("a")
+    path_b = store.get_path("b")
+    store.get_path("a")
+    store.get_path("c")
+
+    stats = store.stats()
+    assert stats["entries"] == 2
+    assert stats["cached_bytes"] == 200
+    assert not os.path.exists(path_b)
+    assert os.path.exists(store.get_path("a")) and os.path.exists(store.get_path("c"))
+
+
+def test_objects_being_validated_are_not_evicted(s3, tmp_path):
+    for name in ["a", "b"]:
+        s3.put_object(Bucket=BUCKET, Key=PREFIX + name, Body=name.encode() * 100)
+    store = ContentStore(bucket_name=BUCKET, prefix=PREFIX, cache_dir=str(tmp_path), s3_client=s3, max_bytes=150)
+    store.get_path("a")
+    get_object = s3.get_object
+
+    def get_object_storing_b(**kwargs):
+        # Another session downloads b while a is validated
+        if kwargs["Key"] == PREFIX + "a" and "IfNoneMatch" in kwargs:
+            store.get_path("b")
+        return get_object(**kwargs)
+
+    s3.get_object = get_object_storing_b
+
+    assert store.read("a") == b"a" * 100
+    assert store.stats()["hits"] == 1
+    s3.get_object = get_object
+    # a was used last, b is evicted by the next download
+    s3.put_object(Bucket=BUCKET, Key=PREFIX + "c", Body=b"c" * 10)
+    store.get_path("c")
+    assert store.read("a") == b"a" * 100
+    assert store.stats()["entries"] == 2
+
+
+def test_keys_are_read_under_the_application_prefix(s3, tmp_path):
+    s3.put_object(Bucket=BUCKET, Key="other-app/data.txt", Body=b"secret")
+    s3.put_object(Bucket=BUCKET, Key=PREFIX + "data.txt", Body=b"mine")
+    store = ContentStore(bucket_name=BUCKET, prefix=PREFIX, cache_dir=str(tmp_path), s3_client=s3)
+
+    assert store.read("data.txt") == b"mine"
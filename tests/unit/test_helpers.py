@@ -0,0 +1,50 @@
+import pytest
+
+from utils.helpers import helpers
+
+
+def test_priorities_are_stable_and_in_range():
+    priorities = helpers.allocate_priorities(["video-summarisation", "chatbot"])
+
+    assert priorities == helpers.allocate_priorities(["chatbot", "video-summarisation"])
+    assert priorities["chatbot"] == helpers.get_hash("chatbot") + 1
+    assert all(1 <= priority <= 50000 for priority in priorities.values())
+
+
+def test_colliding_priorities_are_probed(monkeypatch):
+    monkeypatch.setattr(helpers, "get_hash", staticmethod(lambda aString: 49999))
+
+    priorities = helpers.allocate_priorities(["b", "a", "c"], {"c": 1})
+
+    assert priorities == {"b": 50000, "a": 2, "c": 1}
+
+
+def test_new_application_does_not_move_an_existing_one():
+    # app-319 has the same hash as video-summarisation, and comes first in name order
+    assert helpers.get_hash("app-319") == helpers.get_hash("video-summarisation")
+    priorities = helpers.allocate_priorities(["video-summarisation", "chatbot"])
+
+    new_priorities = helpers.allocate_priorities(["video-summarisation", "chatbot", "app-319"])
+
+    assert {name: new_priorities[name] for name in priorities} == priorities
+    assert new_priorities["app-319"] == priorities["video-summarisation"] + 1
+
+
+def test_explicit_priority_collisions_are_rejected():
+    with pytest.raises(ValueError, match="used by both"):
+        helpers.allocate_priorities(["a", "b"], {"a": 10, "b": 10})
+    with pytest.raises(ValueError, match="not between"):
+        helpers.allocate_priorities(["a"], {"a": 0})
+    with pytest.raises(ValueError, match="Duplicated"):
+        helpers.allocate_priorities(["a", "a"])
+
+
+def test_explicit_priority_of_a_new_application_does_not_move_an_existing_one():
+    priority = helpers.get_hash("video-summarisation") + 1
+
+    with pytest.raises(ValueError, match=f"Listener priority {priority} of chatbot is the priority derived from "
+                                         f"the name of video-summarisation"):
+        helpers.allocate_priorities(["video-summarisation", "chatbot"], {"chatbot": priority})
+    assert helpers.allocate_priorities(["video-summarisation", "chatbot"], {"chatbot": priority + 1}) == {
+        "video-summarisation": priority, "chatbot": priority + 1,
+    }
@@ -0,0 +1,127 @@
+import io
+import json
+import threading
+import time
+
+from botocore.exceptions import ClientError
+
+from utils.cache import ResponseCache
+from utils.llm import Llm
+from utils.throttling import TokenBucket
+
+
+class FakeBedrockClient:
+    """
+    Stand-in for the bedrock-runtime client injecting latency, throttling the
+    first calls of the prompts listed in throttles and failing the prompts
+    listed in failures
+    """
+
+    def __init__(self, latency=0.05, throttles=None, failures=()):
+        self.latency = latency
+        self.throttles = dict(throttles or {})
+        self.failures = failures
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._lock = threading.Lock()
+
+    def invoke_model(self, **kwargs):
+        prompt = json.loads(kwargs["body"])["prompt"]
+        input_text = prompt.split("Human: ")[1].split("\n")[0]
+
+        with self._lock:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            time.sleep(self.latency)
+            with self._lock:
+                if self.throttles.get(input_text, 0) > 0:
+                    self.throttles[input_text] -= 1
+                    raise ClientError({"Error": {"Code": "ThrottlingException", "Message": "Too many requests"}},
+                                      "InvokeModel")
+            if input_text in self.failures:
+                raise ClientError({"Error": {"Code": "ValidationException", "Message": "Invalid"}}, "InvokeModel")
+            return {"body": io.BytesIO(json.dumps({"completion": input_text.upper()}).encode())}
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+
+
+def make_llm(client):
+    return Llm(bedrock_client=client, rate_limiter=TokenBucket(rate=1000, capacity=1000))
+
+
+def test_results_are_in_input_order_with_bounded_concurrency():
+    client = FakeBedrockClient(latency=0.05)
+    llm = make_llm(client)
+    prompts = [f"item {i}" for i in range(12)]
+
+    start = time.perf_counter()
+    results = llm.invoke_many(prompts, max_concurrency=4)
+    elapsed = time.perf_counter() - start
+
+    assert [r["completion"] for r in results] == [p.upper() for p in prompts]
+    assert all(r["error"] is None and r["latency"] >= 0.05 for r in results)
+    assert client.max_in_flight == 4
+    # 12 calls of 50ms on 4 workers run in about 3 rounds
+    assert elapsed < 12 * 0.05
+
+
+def test_throttled_calls_are_retried_and_errors_reported():
+    client = FakeBedrockClient(latency=0.01, throttles={"b": 2}, failures=("c",))
+    llm = make_llm(client)
+
+    results = llm.invoke_many(["a", "b", "c"], max_concurrency=3, base_delay=0.01)
+
+    assert [r["completion"] for r in results] == ["A", "B", None]
+    assert results[1]["attempts"] == 3
+    assert results[2]["error"].response["Error"]["Code"] == "ValidationException"
+    assert llm.rate_limiter.rate < 1000
+
+
+def test_throttled_calls_give_up_after_max_attempts():
+    client = FakeBedrockClient(latency=0, throttles={"a": 10})
+    llm = make_llm(client)
+
+    result, = llm.invoke_many(["a"], max_attempts=2, base_delay=0.01)
+
+    assert result["attempts"] == 2
+    assert result["error"].response["Error"]["Code"] == "ThrottlingException"
+
+
+def test_cache_hits_do_not_take_a_token():
+    rate_limiter = TokenBucket(rate=1000, capacity=1000)
+    llm = Llm(bedrock_client=FakeBedrockClient(latency=0), cache=ResponseCache(), rate_limiter=rate_limiter)
+    llm.invoke_many(["a", "b"])
+    acquired = []
+    rate_limiter.acquire = lambda: acquired.append(True)
+
+    results = llm.invoke_many(["a", "b", "c"])
+
+    assert [r["completion"] for r in results] == ["A", "B", "C"]
+    assert len(acquired) == 1
+
+
+def test_token_bucket_rate_adapts_to_throttling():
+    now = [0.]
+    sleeps = []
+
+    def sleep(seconds):
+        sleeps.append(seconds)
+        now[0] += seconds
+
+    bucket = TokenBucket(rate=4, capacity=1, min_rate=1, increase=1, clock=lambda: now[0], sleep=sleep)
+    bucket.acquire()
+    bucket.acquire()
+    assert sleeps == [0.25]
+
+    bucket.on_throttle()
+    bucket.on_throttle()
+    bucket.on_throttle()
+    assert bucket.rate == 1
+    bucket.acquire()
+    assert sleeps[-1] == 1
+
+    for _ in range(10):
+        bucket.on_success()
+    assert bucket.rate == 4
@@ -0,0 +1,140 @@
+import json
+import threading
+
+import boto3
+import pytest
+from moto import mock_aws
+
+from utils.jobs import JobClient, JobStore, JobWorker
+
+BUCKET = "applications-bucket"
+
+
+@pytest.fixture
+def aws():
+    with mock_aws():
+        s3 = boto3.client("s3", region_name="us-east-1")
+        s3.create_bucket(Bucket=BUCKET)
+        sqs = boto3.client("sqs", region_name="us-east-1")
+        queue_url = sqs.create_queue(QueueName="jobs")["QueueUrl"]
+        store = JobStore(bucket_name=BUCKET, prefix="video-summarisation/", s3_client=s3)
+        yield s3, sqs, queue_url, store
+
+
+def make_worker(aws, handlers):
+    s3, sqs, queue_url, store = aws
+    return JobWorker(handlers, queue_url=queue_url, sqs_client=sqs, store=store, wait_time_seconds=0)
+
+
+def test_submitted_jobs_run_on_the_worker(aws):
+    s3, sqs, queue_url, store = aws
+    client = JobClient(queue_url=queue_url, sqs_client=sqs, store=store)
+    worker = make_worker(aws, {"summarize": lambda payload: {"summary": payload["text"].upper()}})
+
+    job_id = client.submit("summarize", {"text": "a long transcript"})
+    assert client.get(job_id)["status"] == "QUEUED"
+
+    assert worker.run_once() == 1
+
+    job = client.get(job_id)
+    assert job["status"] == "COMPLETED"
+    assert job["result"] == {"summary": "A LONG TRANSCRIPT"}
+    # The result is under the prefix of the application, and the job left the queue
+    s3.head_object(Bucket=BUCKET, Key=f"video-summarisation/jobs/{job_id}.json")
+    assert worker.run_once() == 0
+
+
+def test_payloads_larger_than_a_message_are_stored_in_the_bucket(aws):
+    s3, sqs, queue_url, store = aws
+    client = JobClient(queue_url=queue_url, sqs_client=sqs, store=store)
+    worker = make_worker(aws, {"summarize": lambda payload: {"length": len(payload["text"])}})
+    # Larger than the size limit of the SQS messages
+    text = "a long transcript " * 100000
+
+    job_id = client.submit("summarize", {"text": text})
+
+    message, = sqs.receive_message(QueueUrl=queue_url, VisibilityTimeout=0)["Messages"]
+    assert json.loads(message["Body"]) == {"job_id": job_id, "kind": "summarize",
+                                           "input_key": f"video-summarisation/jobs/{job_id}/input.json"}
+    assert worker.run_once() == 1
+
+    assert client.get(job_id)["result"] == {"length": len(text)}
+
+
+def test_failed_jobs_report_their_error(aws):
+    s3, sqs, queue_url, store = aws
+    client = JobClient(queue_url=queue_url, sqs_client=sqs, store=store)
+
+    def fail(payload):
+        raise RuntimeError("model unavailable")
+
+    worker = make_worker(aws, {"summarize": fail})
+    failed_id = client.submit("summarize", {"text": "text"})
+    unknown_id = client.submit("translate", {"text": "text"})
+
+    while worker.run_once():
+        pass
+
+    assert client.get(failed_id)["status"] == "FAILED"
+    assert "model unavailable" in client.get(failed_id)["error"]
+    assert "No handler" in client.get(unknown_id)["error"]
+
+
+def test_invalid_messages_are_left_in_the_queue(aws):
+    s3, sqs, queue_url, store = aws
+    client = JobClient(queue_url=queue_url, sqs_client=sqs, store=store)
+    worker = make_worker(aws, {"summarize": lambda payload: payload})
+    sqs.send_message(QueueUrl=queue_url, MessageBody="not a job")
+    sqs.send_message(QueueUrl=queue_url, MessageBody='{"kind": "summarize"}')
+    job_id = client.submit("summarize", {"text": "text"})
+
+    assert worker.run_once() == 3
+
+    assert client.get(job_id)["status"] == "COMPLETED"
+    attributes = sqs.get_queue_attributes(QueueUrl=queue_url, AttributeNames=["ApproximateNumberOfMessagesNotVisible"])
+    assert attributes["Attributes"]["ApproximateNumberOfMessagesNotVisible"] == "2"
+
+
+def test_the_visibility_of_running_jobs_is_extended(aws):
+    s3, sqs, queue_url, store = aws
+    sqs.set_queue_attributes(QueueUrl=queue_url, Attributes={"VisibilityTimeout": "1"})
+    client = JobClient(queue_url=queue_url, sqs_client=sqs, store=store)
+
+    def receive_after_the_timeout(payload):
+        threading.Event().wait(1.5)
+        return {"received": len(sqs.receive_message(QueueUrl=queue_url).get("Messages", []))}
+
+    worker = JobWorker({"wait": receive_after_the_timeout}, queue_url=queue_url, sqs_client=sqs, store=store,
+                       wait_time_seconds=0, visibility_timeout=1)
+    job_id = client.submit("wait", {})
+
+    assert worker.run_once() == 1
+
+    assert client.get(job_id)["result"] == {"received": 0}
+
+
+def test_jobs_run_concurrently_and_the_worker_stops(aws):
+    s3, sqs, queue_url, store = aws
+    client = JobClient(queue_url=queue_url, sqs_client=sqs, store=store)
+    barrier = threading.Barrier(3, timeout=5)
+
+    def wait_for_the_others(payload):
+        barrier.wait()
+        return payload
+
+    stop_event = threading.Event()
+    job_ids = [client.submit("wait", {"i": i}) for i in range(3)]
+    worker = JobWorker({"wait": wait_for_the_others}, queue_url=queue_url, sqs_client=sqs, store=store,
+                       max_concurrency=3, wait_time_seconds=0)
+    thread = threading.Thread(target=worker.run, args=(stop_event,))
+    thread.start()
+
+    for _ in range(100):
+        if all(client.get(job_id)["status"] == "COMPLETED" for job_id in job_ids):
+            break
+        stop_event.wait(0.05)
+    stop_event.set()
+    thread.join(timeout=5)
+
+    assert [client.get(job_id)["result"] for job_id in job_ids] == [{"i": 0}, {"i": 1}, {"i": 2}]
+    assert not thread.is_alive()
@@ -0,0 +1,60 @@
+import json
+
+from utils.llm import Llm
+
+
+class FakeBedrockClient:
+    """Stand-in for the bedrock-runtime client returning a canned event stream"""
+
+    def __init__(self, completions):
+        self.completions = completions
+        self.requests = []
+
+    def invoke_model_with_response_stream(self, **kwargs):
+        self.requests.append(kwargs)
+        events = [{"chunk": {"bytes": json.dumps({"completion": completion}).encode()}}
+                  for completion in self.completions]
+        return {"body": iter(events)}
+
+
+def test_stream_yields_chunks_in_order():
+    client = FakeBedrockClient(["Hola", " mundo", "!"])
+    llm = Llm(bedrock_client=client)
+
+    chunks = list(llm.stream("Say Hello World! in Spanish"))
+
+    assert chunks == ["Hola", " mundo", "!"]
+    assert client.requests[0]["modelId"] == "anthropic.claude-v2"
+    assert "Say Hello World! in Spanish" in json.loads(client.requests[0]["body"])["prompt"]
+
+
+def test_stream_records_time_to_first_token():
+    llm = Llm(bedrock_client=FakeBedrockClient(["Hello"]))
+    assert llm.last_time_to_first_token is None
+
+    stream = llm.stream("Say Hello World!")
+    next(stream)
+
+    assert llm.last_time_to_first_token >= 0
+    list(stream)
+
+
+def test_bedrock_client_is_shared_and_configured_from_environment(monkeypatch):
+    monkeypatch.setattr(Llm, "_clients", {})
+    monkeypatch.setenv("BEDROCK_REGION", "eu-west-3")
+    monkeypatch.setenv("BEDROCK_MODEL_ID", "anthropic.claude-instant-v1")
+    monkeypatch.setenv("BEDROCK_MAX_POOL_CONNECTIONS", "64")
+
+    first, second = Llm(), Llm()
+
+    assert first.bedrock_client is second.bedrock_client
+    assert first.model_id == "anthropic.claude-instant-v1"
+    config = first.bedrock_client.meta.config
+    assert first.bedrock_client.meta.region_name == "eu-west-3"
+    assert config.max_pool_connections == 64
+    assert config.retries["mode"] == "adaptive"
+    assert config.tcp_keepalive is True
+    assert config.read_timeout == 300
+    # invoke_many retries the calls itself
+    assert first.batch_client is second.batch_client
+    assert first.batch_client.meta.config.retries == {"mode": "standard", "total_max_attempts": 1}
@@ -0,0 +1,91 @@
+import json
+import threading
+
+import boto3
+import pytest
+from streamlit_cognito_auth.utils import verify_access_token
+
+from tests.loadtest.fake_aws import APP_CLIENT_ID, POOL_ID, make_server
+from tests.loadtest.run_loadtest import TokenIssuer, recommend
+from utils.auth import SecretCache
+from utils.llm import Llm
+from utils.metrics import Metrics
+from utils.throttling import TokenBucket
+
+
+@pytest.fixture
+def fake_aws():
+    server = make_server(0, ttft=0.05, token_delay=0.001, tokens=20, secrets_latency=0)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield {"region_name": "us-east-1", "endpoint_url": f"http://127.0.0.1:{server.server_address[1]}",
+           "aws_access_key_id": "loadtest", "aws_secret_access_key": "loadtest"}
+    server.shutdown()
+
+
+def test_fake_bedrock_streams_tokens_after_the_time_to_first_token(fake_aws):
+    llm = Llm(bedrock_client=boto3.client("bedrock-runtime", **fake_aws),
+              rate_limiter=TokenBucket(rate=1000, capacity=1000), metrics=Metrics(enabled=False))
+
+    chunks = list(llm.stream("Say hello", use_cache=False))
+
+    assert "".join(chunks) == "".join(f" token{i}" for i in range(20))
+    assert llm.last_time_to_first_token >= 0.05
+    response = llm.invoke("Say hello", use_cache=False)
+    assert json.loads(response["body"].read())["completion"].startswith(" token0")
+
+
+def test_fake_secrets_manager_returns_the_cognito_parameters(fake_aws):
+    cache = SecretCache(client=boto3.client("secretsmanager", **fake_aws))
+
+    secret = json.loads(cache.get_secret("StreamlitApplicationsParamCognitoSecret")["SecretString"])
+
+    assert secret["pool_id"] == POOL_ID
+    assert secret["app_client_id"] == APP_CLIENT_ID
+
+
+def test_access_tokens_are_verified_with_the_jwks_of_the_load_test(monkeypatch, tmp_path):
+    issuer = TokenIssuer(str(tmp_path / "loadtest.pem"))
+    monkeypatch.setenv("COGNITO_JWKS", json.dumps(issuer.jwks))
+
+    claims = verify_access_token(POOL_ID, APP_CLIENT_ID, "us-east-1", issuer.access_token("loadtest-1"))
+
+    assert claims["username"] == "loadtest-1"
+    # The key is reused from the key file
+    assert TokenIssuer(str(tmp_path / "loadtest.pem")).jwks == issuer.jwks
+
+
+def stage(sessions, p95_ms, cpu_percent=10., peak_memory_mb=None, errors=0):
+    return {"sessions": sessions, "p50_ms": p95_ms / 2, "p95_ms": p95_ms, "errors": errors,
+            "cpu_percent": cpu_percent, "peak_memory_mb": peak_memory_mb}
+
+
+def test_recommendation_keeps_the_largest_stage_within_the_targets():
+    stages = [
+        stage(1, 600, peak_memory_mb=150),
+        stage(5, 800, peak_memory_mb=170),
+        stage(10, 1500, peak_memory_mb=190),
+        stage(20, 7000, peak_memory_mb=230),
+    ]
+
+    recommendation = recommend(stages, task_cpu=256, task_memory_mib=512, p95_target_ms=5000, expected_sessions=95)
+
+    assert recommendation["sessions_per_task"] == 10
+    assert recommendation["limited_by"] == "latency"
+    assert recommendation["memory_per_session_mb"] == pytest.approx(4, rel=0.05)
+    assert recommendation["application_config"] == {
+        "name": "video-summarisation", "cpu": 256, "memory_limit_mib": 512, "min_tasks": 1, "max_tasks": 10,
+    }
+
+
+def test_recommendation_is_limited_by_cpu_memory_and_errors():
+    def limit(*stages):
+        return recommend(list(stages), task_cpu=256, task_memory_mib=512, p95_target_ms=5000,
+                         expected_sessions=10)
+
+    # 80% of a quarter of a vCPU is 20% of a vCPU
+    assert limit(stage(1, 500), stage(5, 500, cpu_percent=21))["sessions_per_task"] == 1
+    assert limit(stage(1, 500), stage(5, 500, cpu_percent=21))["limited_by"] == "cpu"
+    assert limit(stage(1, 500, peak_memory_mb=420))["limited_by"] == "memory"
+    recommendation = limit(stage(1, 500, errors=1))
+    assert recommendation["sessions_per_task"] == 0
+    assert "application_config" not in recommendation
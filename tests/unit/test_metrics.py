@@ -0,0 +1,115 @@
+import io
+import json
+import time
+
+from botocore.awsrequest import AWSResponse
+from botocore.exceptions import ClientError
+
+from utils.cache import ResponseCache
+from utils.llm import Llm
+from utils.metrics import Metrics
+from utils.throttling import TokenBucket
+
+
+class FakeBedrockClient:
+    """Stand-in for the bedrock-runtime client returning token counts"""
+
+    def __init__(self, throttle=False):
+        self.throttle = throttle
+
+    def invoke_model(self, **kwargs):
+        if self.throttle:
+            raise ClientError({"Error": {"Code": "ThrottlingException", "Message": "Too many requests"}}, "InvokeModel")
+        return {
+            "ResponseMetadata": {"HTTPHeaders": {
+                "x-amzn-bedrock-input-token-count": "12",
+                "x-amzn-bedrock-output-token-count": "34",
+            }},
+            "body": io.BytesIO(json.dumps({"completion": "Hola"}).encode()),
+        }
+
+    def invoke_model_with_response_stream(self, **kwargs):
+        return {"body": iter([
+            {"chunk": {"bytes": json.dumps({"completion": "Ho"}).encode()}},
+            {"chunk": {"bytes": json.dumps({
+                "completion": "la",
+                "amazon-bedrock-invocationMetrics": {"inputTokenCount": 5, "outputTokenCount": 2},
+            }).encode()}},
+        ])}
+
+
+def emitted_documents(capsys):
+    return [json.loads(line) for line in capsys.readouterr().out.splitlines() if line.startswith("{")]
+
+
+def test_emf_document_format(capsys):
+    Metrics(application="my-app").emit({"RerunDuration": (12.5, "Milliseconds")}, dimensions={"Page": "home"})
+
+    document, = emitted_documents(capsys)
+    directive, = document["_aws"]["CloudWatchMetrics"]
+    assert directive == {
+        "Namespace": "StreamlitApplications",
+        "Dimensions": [["Application"], ["Application", "Page"]],
+        "Metrics": [{"Name": "RerunDuration", "Unit": "Milliseconds"}],
+    }
+    assert isinstance(document["_aws"]["Timestamp"], int)
+    assert document["Application"] == "my-app"
+    assert document["Page"] == "home"
+    assert document["RerunDuration"] == 12.5
+
+
+def test_llm_emits_call_metrics(capsys):
+    llm = Llm(bedrock_client=FakeBedrockClient(), cache=ResponseCache(), metrics=Metrics(application="my-app"))
+
+    llm.invoke("Say Hello World!")
+    llm.invoke("Say Hello World!")
+    list(llm.stream("Say Hello World! again"))
+
+    invoke, cached_invoke, stream = emitted_documents(capsys)
+    assert invoke["ModelId"] == "anthropic.claude-v2"
+    assert (invoke["InputTokens"], invoke["OutputTokens"], invoke["CacheHit"]) == (12, 34, 0)
+    assert invoke["Latency"] >= 0
+    assert cached_invoke["CacheHit"] == 1
+    assert "InputTokens" not in cached_invoke
+    assert (stream["InputTokens"], stream["OutputTokens"]) == (5, 2)
+    assert stream["TimeToFirstToken"] <= stream["Latency"]
+
+
+def test_llm_emits_throttles(capsys):
+    llm = Llm(bedrock_client=FakeBedrockClient(throttle=True), rate_limiter=TokenBucket(),
+              metrics=Metrics(application="my-app"))
+
+    result, = llm.invoke_many(["Say Hello World!"], max_attempts=2, base_delay=0.01)
+
+    assert result["error"] is not None
+    assert [document["Throttles"] for document in emitted_documents(capsys)] == [1, 1]
+
+
+class RawResponse(io.BytesIO):
+    """Raw HTTP response body of a fake AWSResponse"""
+
+    def stream(self, **kwargs):
+        yield self.getvalue()
+
+
+def test_throttles_retried_by_the_shared_client_are_counted(monkeypatch, capsys):
+    monkeypatch.setattr(Llm, "_clients", {})
+    monkeypatch.setattr(Llm, "metrics", Metrics(application="my-app"))
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "testing")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "testing")
+    # No backoff before the retry
+    monkeypatch.setattr(time, "sleep", lambda seconds: None)
+    llm = Llm(cache=None)
+    responses = [
+        AWSResponse("", 400, {"x-amzn-ErrorType": "ThrottlingException"},
+                    RawResponse(b'{"message": "Too many requests"}')),
+        AWSResponse("", 200, {"Content-Type": "application/json"}, RawResponse(b'{"completion": "Hola"}')),
+    ]
+    # Fake HTTP responses: the first attempt is throttled, the retry succeeds
+    llm.bedrock_client.meta.events.register("before-send.bedrock-runtime", lambda **kwargs: responses.pop(0))
+
+    response = llm.invoke("Say Hello World!")
+
+    assert json.loads(response["body"].read())["completion"] == "Hola"
+    throttles = [document for document in emitted_documents(capsys) if "Throttles" in document]
+    assert [(document["Throttles"], document["ModelId"]) for document in throttles] == [(1, "anthropic.claude-v2")]
@@ -1,6 +1,14 @@
+import fnmatch
+import json
+import os
+import subprocess
+import sys
+
+import pytest
 import aws_cdk as core
 import aws_cdk.assertions as assertions
 
+from config_file import Config, ApplicationConfig
 from streamlit_application_manager.streamlit_application_manager_stack import StreamlitApplicationManagerStack
 
 # example tests. To run these tests, uncomment this file along with the example
@@ -13,3 +21,426 @@ def test_sqs_queue_created():
 #     template.has_resource_properties("AWS::SQS::Queue", {
 #         "VisibilityTimeout": 300
 #     })
+
+
+def test_application_bucket_passed_to_container():
+    app = core.App()
+    stack = StreamlitApplicationManagerStack(app, "streamlit-application-manager")
+    app_stack = stack.node.find_child("video-summarisationStack")
+    template = assertions.Template.from_stack(app_stack)
+
+    template.has_resource_properties("AWS::ECS::TaskDefinition", {
+        "ContainerDefinitions": [assertions.Match.object_like({
+            "Environment": assertions.Match.array_with([
+                {"Name": "APPLICATION_NAME", "Value": "video-summarisation"},
+                {"Name": "APPLICATION_BUCKET_NAME", "Value": assertions.Match.any_value()},
+                {"Name": "BEDROCK_REGION", "Value": "us-east-1"},
+                {"Name": "BEDROCK_MODEL_ID", "Value": "anthropic.claude-v2"},
+            ])
+        })]
+    })
+
+
+def test_services_are_sized_and_autoscaled_from_app_config(monkeypatch):
+    monkeypatch.setattr(Config, "APPLICATION_LIST", [
+        ApplicationConfig(name="busy-app", cpu=1024, memory_limit_mib=2048, min_tasks=2, max_tasks=10,
+                          cpu_target_utilization=60, requests_per_target=300),
+        "tiny-app",
+    ])
+    app = core.App()
+    stack = StreamlitApplicationManagerStack(app, "streamlit-application-manager")
+    busy_template = assertions.Template.from_stack(stack.node.find_child("busy-appStack"))
+    tiny_template = assertions.Template.from_stack(stack.node.find_child("tiny-appStack"))
+
+    busy_template.has_resource_properties("AWS::ECS::TaskDefinition", {"Cpu": "1024", "Memory": "2048"})
+    busy_template.has_resource_properties("AWS::ECS::Service", {"DesiredCount": assertions.Match.absent()})
+    busy_template.has_resource_properties("AWS::ApplicationAutoScaling::ScalableTarget", {
+        "MinCapacity": 2,
+        "MaxCapacity": 10,
+    })
+    busy_template.has_resource_properties("AWS::ApplicationAutoScaling::ScalingPolicy", {
+        "TargetTrackingScalingPolicyConfiguration": assertions.Match.object_like({
+            "PredefinedMetricSpecification": {"PredefinedMetricType": "ECSServiceAverageCPUUtilization"},
+            "TargetValue": 60,
+        })
+    })
+    busy_template.has_resource_properties("AWS::ApplicationAutoScaling::ScalingPolicy", {
+        "TargetTrackingScalingPolicyConfiguration": assertions.Match.object_like({
+            "PredefinedMetricSpecification": assertions.Match.object_like({
+                "PredefinedMetricType": "ALBRequestCountPerTarget"
+            }),
+            "TargetValue": 300,
+        })
+    })
+
+    tiny_template.has_resource_properties("AWS::ECS::TaskDefinition", {"Cpu": "256", "Memory": "512"})
+    tiny_template.resource_count_is("AWS::ApplicationAutoScaling::ScalingPolicy", 2)
+
+
+def test_target_groups_have_sticky_sessions():
+    app = core.App()
+    stack = StreamlitApplicationManagerStack(app, "streamlit-application-manager")
+    template = assertions.Template.from_stack(stack)
+
+    template.has_resource_properties("AWS::ElasticLoadBalancingV2::TargetGroup", {
+        "Name": "video-summarisation",
+        "TargetGroupAttributes": assertions.Match.array_with([
+            {"Key": "stickiness.enabled", "Value": "true"},
+            {"Key": "stickiness.type", "Value": "lb_cookie"},
+            {"Key": "stickiness.lb_cookie.duration_seconds", "Value": "86400"},
+        ])
+    })
+
+
+SYNTH_TEMPLATES_SCRIPT = """
+import json
+import aws_cdk as core
+import aws_cdk.assertions as assertions
+from config_file import Config
+from streamlit_application_manager.streamlit_application_manager_stack import StreamlitApplicationManagerStack
+
+Config.APPLICATION_LIST = ["video-summarisation", "chatbot", "translator"]
+app = core.App()
+stack = StreamlitApplicationManagerStack(app, "streamlit-application-manager")
+stacks = [stack] + [child for child in stack.node.children if isinstance(child, core.NestedStack)]
+print(json.dumps({child.node.path: assertions.Template.from_stack(child).to_json() for child in stacks}, sort_keys=True))
+"""
+
+
+def test_synth_is_deterministic_across_processes():
+    root = os.path.join(os.path.dirname(__file__), "..", "..")
+    outputs = [
+        subprocess.run([sys.executable, "-c", SYNTH_TEMPLATES_SCRIPT], cwd=root, check=True, capture_output=True,
+                       env={**os.environ, "PYTHONHASHSEED": seed}).stdout
+        for seed in ("1", "2")
+    ]
+
+    assert outputs[0] == outputs[1]
+
+
+def test_listener_priorities_come_from_config(monkeypatch):
+    monkeypatch.setattr(Config, "APPLICATION_LIST", [ApplicationConfig(name="chatbot", listener_priority=42)])
+    app = core.App()
+    stack = StreamlitApplicationManagerStack(app, "streamlit-application-manager")
+    template = assertions.Template.from_stack(stack)
+
+    template.has_resource_properties("AWS::ElasticLoadBalancingV2::ListenerRule", {"Priority": 42})
+
+
+def test_graviton_and_spot_capacity_from_app_config(monkeypatch):
+    monkeypatch.setattr(Config, "APPLICATION_LIST", [
+        ApplicationConfig(name="graviton-app", cpu_architecture="ARM64"),
+        ApplicationConfig(name="spot-app", fargate_weight=1, fargate_spot_weight=3),
+    ])
+    app = core.App()
+    stack = StreamlitApplicationManagerStack(app, "streamlit-application-manager")
+    graviton_template = assertions.Template.from_stack(stack.node.find_child("graviton-appStack"))
+    spot_template = assertions.Template.from_stack(stack.node.find_child("spot-appStack"))
+
+    assertions.Template.from_stack(stack).has_resource_properties("AWS::ECS::ClusterCapacityProviderAssociations", {
+        "CapacityProviders": ["FARGATE", "FARGATE_SPOT"],
+    })
+
+    graviton_template.has_resource_properties("AWS::ECS::TaskDefinition", {
+        "RuntimePlatform": {"CpuArchitecture": "ARM64", "OperatingSystemFamily": "LINUX"},
+    })
+    graviton_template.has_resource_properties("AWS::ECS::Service", {
+        "LaunchType": "FARGATE",
+        "CapacityProviderStrategy": assertions.Match.absent(),
+    })
+    graviton_template.has_resource_properties("AWS::CodeBuild::Project", {
+        "Environment": assertions.Match.object_like({"Type": "ARM_CONTAINER"}),
+    })
+
+    spot_template.has_resource_properties("AWS::ECS::TaskDefinition", {
+        "RuntimePlatform": {"CpuArchitecture": "X86_64", "OperatingSystemFamily": "LINUX"},
+    })
+    spot_template.has_resource_properties("AWS::ECS::Service", {
+        "CapacityProviderStrategy": [
+            {"CapacityProvider": "FARGATE", "Weight": 1, "Base": 1},
+            {"CapacityProvider": "FARGATE_SPOT", "Weight": 3},
+        ],
+    })
+    spot_template.has_resource_properties("AWS::CodeBuild::Project", {
+        "Environment": assertions.Match.object_like({"Type": "LINUX_CONTAINER"}),
+    })
+
+
+def test_spot_capacity_of_graviton_tasks_is_rejected(monkeypatch):
+    monkeypatch.setattr(Config, "APPLICATION_LIST", [
+        ApplicationConfig(name="graviton-app", cpu_architecture="ARM64", fargate_spot_weight=3),
+    ])
+
+    with pytest.raises(ValueError, match="FARGATE_SPOT does not support the ARM64 tasks of graviton-app"):
+        StreamlitApplicationManagerStack(core.App(), "streamlit-application-manager")
+
+
+def test_docker_build_reuses_layers_and_can_skip_unchanged_builds():
+    app = core.App()
+    stack = StreamlitApplicationManagerStack(app, "streamlit-application-manager")
+    template = assertions.Template.from_stack(stack.node.find_child("video-summarisationStack"))
+
+    template.has_resource_properties("AWS::CodeBuild::Project", {
+        "Cache": {"Type": "LOCAL", "Modes": ["LOCAL_DOCKER_LAYER_CACHE"]},
+        "Environment": assertions.Match.object_like({"PrivilegedMode": True}),
+    })
+    template.has_resource_properties("AWS::IAM::Policy", {
+        "PolicyDocument": {
+            "Statement": assertions.Match.array_with([
+                assertions.Match.object_like({"Action": "ecr:DescribeImages"}),
+            ]),
+        },
+    })
+
+
+def test_apps_sharing_a_source_folder_share_one_image_asset(monkeypatch):
+    monkeypatch.setattr(Config, "APPLICATION_LIST", [
+        "video-summarisation", "chatbot", "translator",
+        ApplicationConfig(name="graviton-app", cpu_architecture="ARM64"),
+    ])
+    app = core.App()
+    StreamlitApplicationManagerStack(app, "streamlit-application-manager")
+    assembly = app.synth()
+
+    docker_images = {}
+    for artifact in assembly.artifacts:
+        if isinstance(artifact, core.cx_api.AssetManifestArtifact):
+            with open(artifact.file) as f:
+                docker_images.update(json.load(f).get("dockerImages", {}))
+
+    # One image per CPU architecture of the apps built from base_app
+    assert len(docker_images) == 2
+
+
+def synth_sharded_templates(monkeypatch, application_list, shard_count):
+    monkeypatch.setattr(Config, "APPLICATION_LIST", application_list)
+    monkeypatch.setattr(Config, "SHARD_COUNT", shard_count)
+    app = core.App()
+    stack = StreamlitApplicationManagerStack(app, "streamlit-application-manager")
+    shard_stacks = [child for child in stack.node.children if isinstance(child, core.NestedStack)]
+    return stack, shard_stacks, [assertions.Template.from_stack(shard_stack) for shard_stack in shard_stacks]
+
+
+def test_sharding_250_apps_respects_limits(monkeypatch):
+    app_names = [f"app-{i}" for i in range(250)]
+    stack, shard_stacks, shard_templates = synth_sharded_templates(monkeypatch, app_names, 4)
+
+    assert len(shard_stacks) == 4
+    assert sorted(app_stack.app_name for shard_stack in shard_stacks for app_stack in shard_stack.app_stacks) == sorted(app_names)
+
+    for shard_stack, shard_template in zip(shard_stacks, shard_templates):
+        template = shard_template.to_json()
+        shard_template.resource_count_is("AWS::ElasticLoadBalancingV2::LoadBalancer", 1)
+        shard_template.resource_count_is("AWS::CloudFront::Distribution", 1)
+        assert len(shard_template.find_resources("AWS::ElasticLoadBalancingV2::ListenerRule")) <= 100
+        assert len(template["Resources"]) <= 500
+        assert len(template.get("Outputs", {})) <= 200
+        assert len(template.get("Parameters", {})) <= 200
+
+        # The outputs of the applications are in their own stacks
+        assertions.Template.from_stack(shard_stack.app_stacks[0]).has_output("*", {
+            "Description": "url of the application",
+        })
+
+    template = assertions.Template.from_stack(stack).to_json()
+    assert len(template["Resources"]) <= 500
+    assert len(template["Outputs"]) <= 200
+    assertions.Template.from_stack(stack).resource_count_is("AWS::ElasticLoadBalancingV2::LoadBalancer", 0)
+
+
+def test_adding_an_app_only_changes_its_shard(monkeypatch):
+    app_names = [f"app-{i}" for i in range(20)]
+    _, _, before = synth_sharded_templates(monkeypatch, app_names, 4)
+    _, after_stacks, after = synth_sharded_templates(monkeypatch, app_names + ["new-app"], 4)
+
+    changed_shards = [shard for shard in range(4) if before[shard].to_json() != after[shard].to_json()]
+    new_app_shard = next(shard for shard, shard_stack in enumerate(after_stacks)
+                         if "new-app" in [app_stack.app_name for app_stack in shard_stack.app_stacks])
+    assert changed_shards == [new_app_shard]
+
+
+def test_overfull_shards_are_rejected(monkeypatch):
+    with pytest.raises(ValueError, match="more than 90"):
+        synth_sharded_templates(monkeypatch, [ApplicationConfig(name=f"app-{i}", shard=0) for i in range(91)], 2)
+
+
+def test_static_assets_of_each_app_are_cached_at_the_edge(monkeypatch):
+    monkeypatch.setattr(Config, "APPLICATION_LIST", ["video-summarisation", "chatbot"])
+    app = core.App()
+    stack = StreamlitApplicationManagerStack(app, "streamlit-application-manager")
+    template = assertions.Template.from_stack(stack)
+
+    template.has_resource_properties("AWS::CloudFront::CachePolicy", {
+        "CachePolicyConfig": assertions.Match.object_like({
+            "DefaultTTL": 86400,
+            "MaxTTL": 31536000,
+            "ParametersInCacheKeyAndForwardedToOrigin": assertions.Match.object_like({
+                "EnableAcceptEncodingGzip": True,
+                "EnableAcceptEncodingBrotli": True,
+            }),
+        }),
+    })
+
+    distribution_config, = [distribution["Properties"]["DistributionConfig"]
+                            for distribution in template.find_resources("AWS::CloudFront::Distribution").values()]
+    cached_patterns = [behavior["PathPattern"] for behavior in distribution_config["CacheBehaviors"]
+                       if behavior["Compress"] and "CachePolicyId" in behavior]
+    assert distribution_config["DefaultCacheBehavior"]["CachePolicyId"] == "4135ea2d-6df8-44a3-9df3-4b5a84be39ad"
+
+    for app_name in ["video-summarisation", "chatbot"]:
+        for path in [f"/{app_name}/static/js/main.4fb6a6b6.js", f"/{app_name}/static/css/main.css",
+                     f"/{app_name}/favicon.png"]:
+            assert any(fnmatch.fnmatchcase(path, pattern) for pattern in cached_patterns)
+        for path in [f"/{app_name}/_stcore/stream", f"/{app_name}/_stcore/health", f"/{app_name}/"]:
+            assert not any(fnmatch.fnmatchcase(path, pattern) for pattern in cached_patterns)
+
+
+def test_config_can_be_injected():
+    config = type("TestConfig", (Config,), {"APPLICATION_LIST": ["chatbot", "translator"]})
+    app = core.App()
+    stack = StreamlitApplicationManagerStack(app, "streamlit-application-manager", config=config)
+    template = assertions.Template.from_stack(stack)
+
+    template.resource_count_is("AWS::CloudFormation::Stack", 2)
+    assert stack.node.try_find_child("chatbotStack") is not None
+    assert stack.node.try_find_child("video-summarisationStack") is None
+
+
+def test_each_app_has_a_dashboard_and_latency_alarms():
+    app = core.App()
+    stack = StreamlitApplicationManagerStack(app, "streamlit-application-manager")
+    template = assertions.Template.from_stack(stack.node.find_child("video-summarisationStack"))
+
+    template.has_resource_properties("AWS::CloudWatch::Dashboard", {
+        "DashboardName": "StreamlitApplications-video-summarisation",
+    })
+    for metric_name, threshold in [("Latency", 30000), ("RerunDuration", 60000)]:
+        template.has_resource_properties("AWS::CloudWatch::Alarm", {
+            "Namespace": "StreamlitApplications",
+            "MetricName": metric_name,
+            "ExtendedStatistic": "p95",
+            "Dimensions": [{"Name": "Application", "Value": "video-summarisation"}],
+            "Threshold": threshold,
+        })
+
+
+def test_job_mode_adds_a_queue_and_a_worker_service_scaled_on_it():
+    config = type("TestConfig", (Config,), {"APPLICATION_LIST": [
+        ApplicationConfig(name="jobs-app", job_mode=True, worker_max_tasks=6),
+        "interactive-app",
+    ]})
+    app = core.App()
+    stack = StreamlitApplicationManagerStack(app, "streamlit-application-manager", config=config)
+    template = assertions.Template.from_stack(stack.node.find_child("jobs-appStack"))
+
+    template.resource_count_is("AWS::SQS::Queue", 2)
+    template.has_resource_properties("AWS::SQS::Queue", {
+        "VisibilityTimeout": 900,
+        "RedrivePolicy": assertions.Match.object_like({"maxReceiveCount": 3}),
+    })
+    template.resource_count_is("AWS::ECS::Service", 2)
+    template.has_resource_properties("AWS::ECS::Service", {
+        "ServiceName": "jobs-app-worker",
+        "DesiredCount": assertions.Match.absent(),
+    })
+    template.has_resource_properties("AWS::ECS::TaskDefinition", {
+        "Cpu": "512",
+        "ContainerDefinitions": [assertions.Match.object_like({
+            "Command": ["python", "worker.py"],
+            "Environment": assertions.Match.array_with([
+                {"Name": "JOB_QUEUE_URL", "Value": assertions.Match.any_value()},
+                {"Name": "JOB_VISIBILITY_TIMEOUT", "Value": "900"},
+            ]),
+        })]
+    })
+    template.has_resource_properties("AWS::ApplicationAutoScaling::ScalableTarget", {
+        "MinCapacity": 0,
+        "MaxCapacity": 6,
+    })
+    template.has_resource_properties("AWS::CloudWatch::Alarm", {
+        "Metrics": assertions.Match.array_with([
+            assertions.Match.object_like({"Expression": "waiting + running"}),
+        ])
+    })
+    # The pipeline deploys the new images on both services
+    template.has_resource_properties("AWS::CodePipeline::Pipeline", {
+        "Stages": assertions.Match.array_with([assertions.Match.object_like({
+            "Name": "Deploy",
+            "Actions": [assertions.Match.object_like({"Name": "ECS_Deploy"}),
+                        assertions.Match.object_like({"Name": "ECS_Deploy_Worker"})],
+        })])
+    })
+
+    interactive_template = assertions.Template.from_stack(stack.node.find_child("interactive-appStack"))
+    interactive_template.resource_count_is("AWS::SQS::Queue", 0)
+    interactive_template.resource_count_is("AWS::ECS::Service", 1)
+
+
+def synth_vpc_template(nat_gateways, vpc_endpoints, application_list=("video-summarisation",)):
+    config = type("TestConfig", (Config,), {"APPLICATION_LIST": list(application_list),
+                                            "NAT_GATEWAYS": nat_gateways, "VPC_ENDPOINTS": vpc_endpoints})
+    app = core.App()
+    stack = StreamlitApplicationManagerStack(app, "streamlit-application-manager", config=config)
+    return assertions.Template.from_stack(stack)
+
+
+def private_route_table_ids(template):
+    return sorted(
+        logical_id for logical_id in template.find_resources("AWS::EC2::RouteTable")
+        if "PrivateSubnet" in logical_id
+    )
+
+
+def test_vpc_endpoints_keep_task_traffic_off_the_nat_gateways():
+    template = synth_vpc_template(nat_gateways=1, vpc_endpoints=True)
+
+    template.resource_count_is("AWS::EC2::NatGateway", 1)
+    template.has_resource_properties("AWS::EC2::VPCEndpoint", {
+        "VpcEndpointType": "Gateway",
+        "ServiceName": {"Fn::Join": ["", ["com.amazonaws.", {"Ref": "AWS::Region"}, ".s3"]]},
+        "RouteTableIds": [{"Ref": route_table_id} for route_table_id in private_route_table_ids(template)],
+    })
+
+    interface_services = [
+        endpoint["Properties"]["ServiceName"]
+        for endpoint in template.find_resources("AWS::EC2::VPCEndpoint", {
+            "Properties": {"VpcEndpointType": "Interface"}
+        }).values()
+    ]
+    for service in ["ecr.api", "ecr.dkr", "secretsmanager", "bedrock-runtime", "transcribe", "logs"]:
+        assert any(json.dumps(service_name).endswith(f'.{service}"]]}}') for service_name in interface_services), service
+    template.has_resource_properties("AWS::EC2::VPCEndpoint", {
+        "VpcEndpointType": "Interface",
+        "PrivateDnsEnabled": True,
+    })
+
+
+def test_vpc_without_nat_gateways_isolates_the_tasks():
+    template = synth_vpc_template(nat_gateways=0, vpc_endpoints=True,
+                                  application_list=[ApplicationConfig(name="jobs-app", job_mode=True)])
+
+    template.resource_count_is("AWS::EC2::NatGateway", 0)
+    # Only the public subnets have a default route, to the internet gateway
+    for route in template.find_resources("AWS::EC2::Route").values():
+        assert "GatewayId" in route["Properties"]
+        assert "PublicSubnet" in route["Properties"]["RouteTableId"]["Ref"]
+    template.has_resource_properties("AWS::EC2::VPCEndpoint", {
+        "VpcEndpointType": "Gateway",
+        "RouteTableIds": [{"Ref": route_table_id} for route_table_id in private_route_table_ids(template)],
+    })
+    # The queue of the jobs is reached through its own endpoint
+    template.has_resource_properties("AWS::EC2::VPCEndpoint", {
+        "ServiceName": {"Fn::Join": ["", ["com.amazonaws.", {"Ref": "AWS::Region"}, ".sqs"]]},
+    })
+
+
+def test_vpc_without_nat_gateways_requires_endpoints():
+    with pytest.raises(ValueError, match="VPC_ENDPOINTS"):
+        synth_vpc_template(nat_gateways=0, vpc_endpoints=False)
+
+
+def test_vpc_endpoints_are_off_by_default():
+    template = synth_vpc_template(nat_gateways=None, vpc_endpoints=False)
+
+    template.resource_count_is("AWS::EC2::NatGateway", 2)
+    template.resource_count_is("AWS::EC2::VPCEndpoint", 0)
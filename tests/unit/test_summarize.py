@@ -0,0 +1,151 @@
+import hashlib
+import io
+import json
+import threading
+import time
+
+import pytest
+from botocore.exceptions import ClientError
+
+from utils.cache import ResponseCache
+from utils.chunking import estimate_tokens, split_text
+from utils.llm import Llm
+from utils.throttling import TokenBucket
+
+
+def make_text(sentences, seed="sentence"):
+    return " ".join(f"This is {seed} number {i} of the transcript, about topic {i % 7}." for i in range(sentences))
+
+
+class FakeModel:
+    """
+    Deterministic stand-in for the bedrock-runtime client: the completion is
+    a digest of the prompt followed by a fixed text. Records the prompts and
+    counts the calls in flight.
+    """
+
+    def __init__(self, latency=0., fail_on=None):
+        self.latency = latency
+        self.fail_on = fail_on
+        self.prompts = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._lock = threading.Lock()
+
+    def invoke_model(self, **kwargs):
+        prompt = json.loads(kwargs["body"])["prompt"]
+        with self._lock:
+            self.prompts.append(prompt)
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            time.sleep(self.latency)
+            if self.fail_on is not None and self.fail_on in prompt:
+                raise ClientError({"Error": {"Code": "ValidationException", "Message": "Too long"}}, "InvokeModel")
+            digest = hashlib.sha256(prompt.encode("utf-8")).hexdigest()[:8]
+            completion = f" Summary {digest}." + " Some detail of the summarised text." * 5
+            return {"body": io.BytesIO(json.dumps({"completion": completion}).encode())}
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+
+
+def make_llm(model, cache=None):
+    return Llm(bedrock_client=model, cache=cache, rate_limiter=TokenBucket(rate=1000, capacity=1000))
+
+
+def test_chunks_fit_the_budget_overlap_and_cover_the_text():
+    text = make_text(300)
+
+    chunks = split_text(text, max_tokens=200, overlap_tokens=20)
+
+    assert len(chunks) > 10
+    assert all(estimate_tokens(chunk) <= 200 for chunk in chunks)
+    for previous, chunk in zip(chunks, chunks[1:]):
+        last_sentence = previous.split(". ")[-1]
+        assert chunk.startswith(last_sentence)
+    for i in range(300):
+        assert any(f"number {i} of" in chunk for chunk in chunks)
+
+
+def test_long_sentences_are_split():
+    chunks = split_text("word " * 1000, max_tokens=100, overlap_tokens=10)
+
+    assert all(estimate_tokens(chunk) <= 100 for chunk in chunks)
+    assert sum(chunk.count("word") for chunk in chunks) >= 1000
+
+
+def test_an_edit_only_changes_the_chunks_around_it():
+    sentences = make_text(300).split(". ")
+    edited = list(sentences)
+    edited[150] = "This sentence was rewritten by the editor of the transcript"
+
+    chunks = split_text(". ".join(sentences), max_tokens=200, overlap_tokens=20)
+    edited_chunks = split_text(". ".join(edited), max_tokens=200, overlap_tokens=20)
+
+    assert len(set(edited_chunks) - set(chunks)) <= 2
+
+
+def test_summarize_maps_then_reduces_hierarchically():
+    model = FakeModel()
+    llm = make_llm(model)
+    stages = []
+
+    summary = llm.summarize(make_text(300), chunk_tokens=200, overlap_tokens=20,
+                            progress=lambda stage, done, total: stages.append((stage, done, total)))
+
+    chunk_count = len(split_text(make_text(300), max_tokens=200, overlap_tokens=20))
+    map_calls = [prompt for prompt in model.prompts if "<text>" in prompt]
+    assert len(map_calls) == chunk_count
+    assert summary.startswith("Summary ")
+    # The summaries are combined in several levels, the last one with a single call
+    assert ("map", chunk_count, chunk_count) in stages
+    totals = {stage: total for stage, done, total in stages}
+    assert list(totals) == ["map"] + [f"reduce {level}" for level in range(1, len(totals))]
+    assert len(totals) > 2
+    assert list(totals.values()) == sorted(totals.values(), reverse=True)
+    assert stages[-1] == (f"reduce {len(totals) - 1}", 1, 1)
+    # The result is deterministic
+    assert make_llm(FakeModel()).summarize(make_text(300), chunk_tokens=200, overlap_tokens=20) == summary
+
+
+def test_summarize_has_bounded_concurrency():
+    model = FakeModel(latency=0.02)
+    llm = make_llm(model)
+
+    llm.summarize(make_text(200), chunk_tokens=200, overlap_tokens=20, max_concurrency=3)
+
+    assert model.max_in_flight == 3
+
+
+def test_an_edit_only_reruns_the_affected_chunks():
+    sentences = make_text(300).split(". ")
+    edited = list(sentences)
+    edited[150] = "This sentence was rewritten by the editor of the transcript"
+    model = FakeModel()
+    llm = make_llm(model, cache=ResponseCache())
+
+    llm.summarize(". ".join(sentences), chunk_tokens=200, overlap_tokens=20)
+    first_calls = len(model.prompts)
+    model.prompts.clear()
+    llm.summarize(". ".join(edited), chunk_tokens=200, overlap_tokens=20)
+
+    map_calls = [prompt for prompt in model.prompts if "<text>" in prompt]
+    assert 1 <= len(map_calls) <= 2
+    assert len(model.prompts) < first_calls / 2
+
+
+def test_summarize_raises_the_errors_of_the_model():
+    llm = make_llm(FakeModel(fail_on="number 42 of"))
+
+    with pytest.raises(ClientError):
+        llm.summarize(make_text(100), chunk_tokens=200, overlap_tokens=20)
+
+
+def test_short_text_is_summarised_in_one_call():
+    model = FakeModel()
+
+    summary = make_llm(model).summarize("A short transcript.")
+
+    assert len(model.prompts) == 1
+    assert summary.startswith("Summary ")
@@ -0,0 +1,78 @@
+import io
+import json
+
+import boto3
+import pytest
+from moto import mock_aws
+
+from utils.transcribe import Transcriber, TranscriptionError
+
+BUCKET = "applications-bucket"
+
+
+@pytest.fixture
+def transcriber():
+    with mock_aws():
+        s3 = boto3.client("s3", region_name="us-east-1")
+        s3.create_bucket(Bucket=BUCKET)
+        yield Transcriber(bucket_name=BUCKET, prefix="video-summarisation/", s3_client=s3,
+                          transcribe_client=boto3.client("transcribe", region_name="us-east-1"),
+                          part_size=5 * 1024 * 1024)
+
+
+def write_transcript(transcriber, output_key, segments):
+    transcriber.s3_client.put_object(Bucket=BUCKET, Key=output_key, Body=json.dumps({
+        "results": {
+            "transcripts": [{"transcript": " ".join(segments)}],
+            "audio_segments": [{"id": i, "transcript": segment} for i, segment in enumerate(segments)],
+        }
+    }))
+
+
+def test_upload_is_multipart_under_app_prefix(transcriber):
+    media = io.BytesIO(b"x" * (12 * 1024 * 1024))
+
+    key = transcriber.upload(media, "uploads/video.mp4")
+
+    assert key.startswith("video-summarisation/media/") and key.endswith("/video.mp4")
+    head = transcriber.s3_client.head_object(Bucket=BUCKET, Key=key)
+    assert head["ContentLength"] == 12 * 1024 * 1024
+    # The ETag of multipart uploads ends with the number of parts
+    assert head["ETag"].strip('"').endswith("-3")
+
+
+def test_transcript_is_delivered_by_segments(transcriber, monkeypatch):
+    sleeps = []
+    started = []
+    start_transcription_job = transcriber.transcribe_client.start_transcription_job
+
+    def start_and_write_transcript(**kwargs):
+        started.append(kwargs)
+        write_transcript(transcriber, kwargs["OutputKey"], ["Hello.", "World."])
+        return start_transcription_job(**kwargs)
+
+    monkeypatch.setattr(transcriber.transcribe_client, "start_transcription_job", start_and_write_transcript)
+
+    job = transcriber.transcribe(io.BytesIO(b"media"), "video.mp4", initial_delay=1, max_delay=1.5,
+                                 sleep=sleeps.append)
+
+    assert list(job.segments()) == ["Hello.", "World."]
+    assert job.wait() == "Hello. World."
+    assert job.done() and job.status == "COMPLETED"
+    assert started[0]["IdentifyLanguage"] is True
+    assert started[0]["OutputKey"].startswith("video-summarisation/transcripts/")
+    # Polling backs off exponentially, up to the max delay
+    assert sleeps == [1, 1.5]
+
+
+def test_failed_jobs_raise(transcriber, monkeypatch):
+    monkeypatch.setattr(transcriber.transcribe_client, "get_transcription_job", lambda **kwargs: {
+        "TranscriptionJob": {"TranscriptionJobStatus": "FAILED", "FailureReason": "Unsupported media"}
+    })
+
+    job = transcriber.start("video-summarisation/media/video.mp4", language_code="en-US", sleep=lambda delay: None)
+
+    with pytest.raises(TranscriptionError, match="Unsupported media"):
+        list(job.segments())
+    with pytest.raises(TranscriptionError):
+        job.wait()
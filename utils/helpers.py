@@ -1,9 +1,75 @@
 #this module contains helpers functions
 
+import hashlib
 import random
+
+#ALB listener rule priorities are between 1 and 50000
+MAX_LISTENER_PRIORITY = 50000
+
 class helpers:
 
     #a static function that returns a hash between 0 and 50000
+    #the hash is stable across processes, unlike the builtin hash() of strings
     @staticmethod
     def get_hash(aString:str):
-        return hash(aString) % 50000
\ No newline at end of file
+        return int(hashlib.sha256(aString.encode("utf-8")).hexdigest(), 16) % 50000
+
+    #a static function that returns a dict with a listener rule priority for each application name
+    #explicit priorities are kept as is, other applications get the priority given by their hash,
+    #or the next free one when it is already used
+    #an explicit priority cannot be the hash priority of another application, it would move its rule
+    #applications are allocated in the order of the list, new applications being appended to it,
+    #so that a new application never takes the priority of an application already deployed
+    @staticmethod
+    def allocate_priorities(app_names, explicit_priorities=None):
+        explicit_priorities = explicit_priorities or {}
+
+        if len(set(app_names)) != len(app_names):
+            raise ValueError(f"Duplicated application names in {app_names}")
+
+        priorities = {}
+        used = {}
+        for app_name, priority in explicit_priorities.items():
+            if not 1 <= priority <= MAX_LISTENER_PRIORITY:
+                raise ValueError(f"Listener priority {priority} of {app_name} is not between 1 and {MAX_LISTENER_PRIORITY}")
+            if priority in used:
+                raise ValueError(f"Listener priority {priority} is used by both {used[priority]} and {app_name}")
+            priorities[app_name] = priority
+            used[priority] = app_name
+
+        hashed_app_names = [app_name for app_name in app_names if app_name not in explicit_priorities]
+        for app_name in hashed_app_names:
+            priority = helpers.get_hash(app_name) + 1
+            if priority in used:
+                raise ValueError(f"Listener priority {priority} of {used[priority]} is the priority derived from "
+                                 f"the name of {app_name}, it would move the listener rule of {app_name}")
+
+        for app_name in hashed_app_names:
+            if len(used) >= MAX_LISTENER_PRIORITY:
+                raise ValueError(f"No listener priority left for {app_name}")
+            priority = helpers.get_hash(app_name) + 1
+            while priority in used:
+                priority = priority % MAX_LISTENER_PRIORITY + 1
+            priorities[app_name] = priority
+            used[priority] = app_name
+
+        return priorities
+
+    #a static function that returns, for each of the shard_count shards, the list of the applications of the shard
+    #an application goes to its explicit shard, or to the shard given by the hash of its name
+    #so that adding or removing an application does not move the other ones
+    @staticmethod
+    def allocate_shards(app_configs, shard_count, max_per_shard):
+        shards = [[] for _ in range(shard_count)]
+        for app_config in app_configs:
+            shard = app_config.shard if app_config.shard is not None else helpers.get_hash(app_config.name) % shard_count
+            if not 0 <= shard < shard_count:
+                raise ValueError(f"Shard {shard} of {app_config.name} is not between 0 and {shard_count - 1}")
+            shards[shard].append(app_config)
+
+        for shard, shard_app_configs in enumerate(shards):
+            if len(shard_app_configs) > max_per_shard:
+                raise ValueError(f"Shard {shard} has {len(shard_app_configs)} applications, more than {max_per_shard}: "
+                                 f"increase the number of shards or set the shard of some applications")
+
+        return shards